@@ -14,12 +14,210 @@
 # Note: to run, you may have to install the 'openpyxl' Python library on your computer.
 # To do so, run the following command:
 #      $ pip install openpyxl
+# openpyxl is only needed to produce xlsx files (see option -f).
 
-import epp_reader as r
-import epp_writer as w
+# To keep the start-up time low, only light modules are imported here. The EPP modules
+# (and openpyxl, through epp_writer) are imported by the stage that needs them.
 import os
+import sys
+import glob
+import time
 import argparse as ap
 
+
+def read_epp(input_filename: str, unsorted: bool, use_cache: bool, mapped: bool = False, stripped: dict = None):
+    """ read and parse a csv file, or fetch its EPP structure from the cache.
+    With mapped, the file is memory-mapped (see epp_mmap) instead of streamed.
+    When the file is streamed, the non-printable characters removed are counted in
+    stripped by line number (see epp_reader.clean_lines()). """
+    
+    import epp_reader as r
+    import epp_cache as c
+    
+    parse = r.parse_indexed_records if unsorted else r.parse_records
+    if mapped:
+        import epp_mmap as mm
+        if unsorted:
+            def read(f):
+                with mm.MappedExport(f) as export:
+                    return parse(export.records())
+        else:
+            read = mm.parse_mapped
+    else:
+        read = lambda f: parse(r.stream_records(f, stripped))
+    
+    if not use_cache:
+        return read(input_filename)
+    # both readers produce the same EPP: they share the cache entries
+    mode = "unsorted" if unsorted else "sorted"
+    return c.cached_parse(input_filename, read, mode)
+
+
+def stream_teams(input_filename: str, min: int, max: int, mapped: bool = False, stripped: dict = None):
+    """ generator that reads, parses and computes the teams of a sorted csv file one at a
+    time, without building the EPP tree: memory usage is bounded by the size of a team
+    (plus the writer's, see epp_writer). The cache, which stores whole EPP structures, is
+    not used. stripped: see read_epp(). """
+    
+    import epp_reader as r
+    
+    if mapped:
+        import epp_mmap as mm
+        with mm.MappedExport(input_filename) as export:
+            for team in export:
+                team.compute(min, max)
+                yield team
+    else:
+        for team in r.parse_team_records(r.stream_records(input_filename, stripped)):
+            team.compute(min, max)
+            yield team
+
+
+def read_columnar(input_filename: str, unsorted: bool, use_cache: bool, mapped: bool = False, stripped: dict = None):
+    """ same as read_epp(), but returns the peer evaluation in columnar form (see epp_columnar).
+    Sorted records are converted without building the EPP tree. """
+    
+    import epp_reader as r
+    import epp_cache as c
+    import epp_columnar as col
+    
+    if mapped:
+        import epp_mmap as mm
+        def records(f):
+            with mm.MappedExport(f) as export:
+                yield from export.records()
+    else:
+        records = lambda f: r.stream_records(f, stripped)
+    if unsorted:
+        read = lambda f: col.from_epp(r.parse_indexed_records(records(f)))
+    else:
+        read = lambda f: col.from_records(records(f))
+    
+    if not use_cache:
+        return read(input_filename)
+    mode = "columnar-unsorted" if unsorted else "columnar-sorted"
+    return c.cached_parse(input_filename, read, mode)
+
+
+def write_epp(output_filename: str, epp, format: str, streaming: bool) -> None:
+    """ write the results in the requested format (see epp_writer.WRITERS).
+    openpyxl is only loaded for xlsx. """
+    
+    import epp_writer as w
+    
+    if format == "xlsx" and streaming:
+        format = "xlsx-stream"
+    w.write_teams(output_filename, epp, format)
+
+
+def process_file(input_filename: str, output_filename: str, min: int, max: int, unsorted: bool, streaming: bool, use_cache: bool, format: str) -> tuple:
+    """ read, parse, compute and write a single csv file.
+    Used as the worker of the batch mode: never raises, returns a tuple
+    (input_filename, output_filename, elapsed time in seconds, error message or None) """
+    
+    start = time.perf_counter()
+    try:
+        if use_cache or unsorted:
+            teams = read_epp(input_filename, unsorted, use_cache)
+            teams.compute(min, max)
+        else:
+            teams = stream_teams(input_filename, min, max)
+        write_epp(output_filename, teams, format, streaming)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return (input_filename, output_filename, time.perf_counter() - start, error)
+
+
+def default_output(input_filename: str, format: str) -> str:
+    """ return the default output file name of a csv file: the same name with the suffix
+    of the format. A csv output is suffixed with _epp.csv so that it never replaces the export. """
+    
+    name_without_suffix = os.path.splitext(input_filename)[0]
+    if format == "csv":
+        return name_without_suffix + "_epp.csv"
+    return name_without_suffix + "." + format
+
+
+def is_input(output_filename: str, input_filenames: list) -> bool:
+    """ True if output_filename designates one of the input files (writing it would destroy it) """
+    
+    for input_filename in input_filenames:
+        if os.path.realpath(output_filename) == os.path.realpath(input_filename):
+            return True
+        if os.path.exists(output_filename) and os.path.exists(input_filename) and os.path.samefile(output_filename, input_filename):
+            return True
+    return False
+
+
+# suffixes of the csv files produced by this program (see default_output() and
+# epp_rounds.default_output()): they are not exports
+OUTPUT_SUFFIXES = ("_epp.csv", "_cumul.csv")
+
+
+def expand_batch(names: list) -> list:
+    """ expand a list of csv files, directories and glob patterns into a list of csv files.
+    Directories and patterns skip the csv files produced by a previous run (OUTPUT_SUFFIXES);
+    a file named explicitly is always kept. """
+    
+    filenames = []
+    for name in names:
+        if os.path.isdir(name):
+            matches = sorted(glob.glob(os.path.join(name, "*.csv")))
+        elif os.path.exists(name):
+            filenames.append(name)
+            continue
+        else:
+            matches = sorted(glob.glob(name))
+            if len(matches) == 0:
+                raise NameError("Fichier invalide: " + name)
+        filenames += [f for f in matches if not f.endswith(OUTPUT_SUFFIXES)]
+    return filenames
+
+
+def process_batch(filenames: list, min: int, max: int, unsorted: bool, streaming: bool, use_cache: bool, format: str, jobs: int) -> int:
+    """ process several csv files in a process pool. Each output file is written next to
+    its csv file. A failure does not abort the batch. Prints a summary and returns
+    the number of failures. """
+    
+    import concurrent.futures as cf
+    
+    results = []
+    jobs_list = []
+    for f in filenames:
+        output_filename = default_output(f, format)
+        if is_input(output_filename, filenames):
+            results.append((f, output_filename, 0.0, "le fichier produit serait un des fichiers csv lus: " + output_filename))
+        else:
+            jobs_list.append((f, output_filename))
+    
+    start = time.perf_counter()
+    with cf.ProcessPoolExecutor(max_workers = jobs) as pool:
+        futures = {pool.submit(process_file, f, output_filename, min, max, unsorted, streaming, use_cache, format): (f, output_filename) for f, output_filename in jobs_list}
+        for future in cf.as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # process_file() never raises: the worker died (ex. BrokenProcessPool,
+                # which also fails every file still pending)
+                f, output_filename = futures[future]
+                result = (f, output_filename, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+            print("Fichier traité: " + result[0])
+            results.append(result)
+    
+    failures = 0
+    print()
+    print("Sommaire du traitement par lots")
+    for input_filename, output_filename, elapsed, error in sorted(results):
+        if error is None:
+            print(f"  OK     {elapsed:8.2f} s  {input_filename} -> {output_filename}")
+        else:
+            failures += 1
+            print(f"  ÉCHEC  {elapsed:8.2f} s  {input_filename}: {error}")
+    print(f"{len(results) - failures} fichier(s) traité(s), {failures} échec(s)")
+    return failures
+
+
 if __name__ == '__main__':
     #
     # parse the command line
@@ -29,43 +227,73 @@ if __name__ == '__main__':
 """
 Ce programme produit un ficher xlsx à partir de l'export des évaluations (.csv).
 Le fichier_csv doit provenir de l'export des évaluations (sans multiligne) du Workshop ÉTS.
-Lorsque le ficher_xlsx est omis, il portera le même nom que le fichier csv (sauf le suffixe).
+Lorsque le ficher_xlsx est omis, il portera le même nom que le fichier csv (sauf le suffixe;
+avec -f csv, le suffixe est _epp.csv). Le fichier produit ne peut pas être le fichier csv lu.
+L'option -f permet de produire plutôt un fichier csv, json, jsonl (JSON Lines) ou parquet
+contenant les mêmes colonnes (parquet nécessite la librairie pyarrow).
 Les options -ELE400 et -ELE795 sont mutuellement exclusives. Ne spécifiez qu'une seule d'entre elles.
 Les options -min et -max seront ignorées si l'option -ELE400 ou -ELE795 a été spécifiée.
 """)
-    parser.add_argument('fichier_csv', nargs = 1, help = 'fichier csv à convertir (obligatoire)')
-    parser.add_argument('fichier_xlsx', nargs = '?', help = 'fichier xlsx produit (optionnel)')
+    parser.add_argument('fichier_csv', nargs = '?', help = 'fichier csv à convertir (obligatoire sauf avec -b)')
+    parser.add_argument('fichier_xlsx', nargs = '?', help = 'fichier xlsx (ou autre format selon -f) produit (optionnel)')
     parser.add_argument('-ELE400', action='store_true', help = 'min et max sont initialisés à 1 et 5 pour ELE400')
     parser.add_argument('-ELE795', action='store_true', help = 'min et max sont initialisés à 0 et 3 pour ELE795')
     parser.add_argument('-min', nargs = 1, type = int, default = [1], choices = [0, 1], help = 'score minimum pour un aspect d''évaluation')
     parser.add_argument('-max', nargs = 1, type = int, default = [5], choices = [2, 3, 4, 5], help = 'score maximum pour un aspect d''évaluation')
+    parser.add_argument('-u', '--unsorted', action='store_true', help = 'accepte un fichier csv dont les lignes ne sont pas triées (ou plusieurs exports concaténés)')
+    parser.add_argument('-m', '--mmap', action='store_true', help = 'lit le fichier csv en mémoire virtuelle, équipe par équipe (très gros fichiers)')
+    parser.add_argument('-f', '--format', default = 'xlsx', choices = ['xlsx', 'csv', 'json', 'jsonl', 'parquet'], help = 'format du fichier produit (défaut: xlsx; les autres formats ne nécessitent pas openpyxl)')
+    parser.add_argument('-s', '--streaming', action='store_true', help = 'écrit le fichier xlsx en continu (plus rapide, moins de mémoire)')
+    parser.add_argument('-b', '--batch', nargs = '+', metavar = 'csv', help = 'traite plusieurs fichiers csv, répertoires ou motifs (ex. "*.csv") en parallèle; les répertoires et motifs ignorent les fichiers produits (*_epp.csv, *_cumul.csv)')
+    parser.add_argument('-r', '--rounds', nargs = '+', metavar = 'csv', help = 'combine plusieurs rondes d\'EPP (un fichier csv par ronde, en ordre) dans un seul fichier; les étudiants sont associés par courriel')
+    parser.add_argument('-w', '--weights', nargs = '+', type = float, metavar = 'poids', help = 'poids de chaque ronde dans le facteur cumulatif, avec -r (défaut: 1)')
+    parser.add_argument('-o', '--output', metavar = 'fichier', help = 'fichier produit avec -r (défaut: premier fichier csv avec le suffixe _cumul); -r accepte plusieurs fichiers: un fichier produit placé après eux serait lu comme une ronde')
+    parser.add_argument('-p', '--parallel', action='store_true', help = 'calcule les notes sous forme de tableaux numpy, par groupes d\'équipes en parallèle lorsque le fichier est assez gros pour que ce soit plus rapide (voir epp_parallel)')
+    parser.add_argument('-j', '--jobs', nargs = 1, type = int, default = [None], help = 'nombre de processus utilisés avec -b, -r ou -p (défaut: nombre de processeurs)')
+    parser.add_argument('--no-cache', action='store_true', help = 'ignore la cache des fichiers csv déjà lus (~/.epp_cache); sans -u ni -p, les équipes sont alors lues, calculées et écrites une à une (mémoire minimale)')
+    parser.add_argument('--clear-cache', action='store_true', help = 'vide la cache avant le traitement')
+    parser.add_argument('--profile', '--stats', dest = 'profile', action='store_true', help = 'affiche le temps, le temps CPU et les compteurs de chaque étape; le fichier csv étant nettoyé et lu pendant l\'analyse, l\'étape parse inclut le nettoyage et la lecture (sauf avec -m)')
+    parser.add_argument('--profile-memory', action='store_true', help = 'avec --profile, mesure aussi la mémoire maximale de chaque étape (tracemalloc: les temps sont alors beaucoup plus longs)')
+    parser.add_argument('--profile-json', nargs = 1, metavar = 'fichier_json', help = 'écrit aussi les mesures de --profile dans un fichier json')
     parser.add_argument('-v', '--verbose', action='store_true', help = 'affiche les données à la console (pour déverminage)')
     
     args = parser.parse_args()
+    if args.fichier_csv == None and args.batch == None and args.rounds == None:
+        parser.error("le fichier_csv est obligatoire (ou utilisez l'option -b ou -r)")
+    if args.output != None and args.rounds == None:
+        parser.error("l'option -o s'utilise avec -r (sinon, donnez le fichier_xlsx après le fichier_csv)")
+    # -b and -r process their files in worker processes, out of reach of the collector
+    if (args.profile or args.profile_memory or args.profile_json != None) and (args.batch != None or args.rounds != None):
+        parser.error("les options --profile, --profile-memory et --profile-json ne s'utilisent pas avec -b ni -r")
     if args.verbose:
         print("Parametres")
-        print("  fichier_csv : " + args.fichier_csv[0])
+        print("  fichier_csv : " + str(args.fichier_csv))
         print("  fichier_xlsx: " + str(args.fichier_xlsx))
         print("  ELE400      : " + str(args.ELE400))
         print("  ELE795      : " + str(args.ELE795))
         print("  min         : " + str(args.min[0]))
         print("  max         : " + str(args.max[0]))
+        print("  unsorted    : " + str(args.unsorted))
+        print("  mmap        : " + str(args.mmap))
+        print("  format      : " + args.format)
+        print("  streaming   : " + str(args.streaming))
+        print("  batch       : " + str(args.batch))
+        print("  rounds      : " + str(args.rounds))
+        print("  weights     : " + str(args.weights))
+        print("  output      : " + str(args.output))
+        print("  parallel    : " + str(args.parallel))
+        print("  jobs        : " + str(args.jobs[0]))
+        print("  no_cache    : " + str(args.no_cache))
+        print("  clear_cache : " + str(args.clear_cache))
+        print("  profile     : " + str(args.profile))
+        print("  profile_mem : " + str(args.profile_memory))
+        print("  profile_json: " + str(args.profile_json))
         print("  verbose     : " + str(args.verbose))
         print()
     
-    input_filename = args.fichier_csv[0]
-    
-    # check if the input csv file exists
-    if os.path.exists(input_filename):
-        name_without_suffix = os.path.splitext(input_filename)[0] 
-        temp_filename   = name_without_suffix + ".tmp"
-        # use a specific output file if it was specified on the command line
-        if args.fichier_xlsx == None:
-            output_filename = name_without_suffix + ".xlsx"
-        else:
-            output_filename = args.fichier_xlsx
-    else:
-        raise NameError("Fichier invalide: " + input_filename)
+    if args.clear_cache:
+        import epp_cache as c
+        c.clear()
     
     # check options
     min = args.min[0]
@@ -86,31 +314,138 @@ Les options -min et -max seront ignorées si l'option -ELE400 ou -ELE795 a été
         msg = f"Les calculs réalisés avec aspect min = {min} et aspect max = {max}"
     print(msg)
     
+    #
+    # Batch mode: process every file in a process pool
+    #
+    
+    if args.batch != None:
+        filenames = args.batch
+        if args.fichier_csv != None:
+            filenames = [args.fichier_csv] + filenames
+        failures = process_batch(expand_batch(filenames), min, max, args.unsorted, args.streaming, not args.no_cache, args.format, args.jobs[0])
+        sys.exit(1 if failures > 0 else 0)
+    
+    #
+    # Rounds mode: combine several exports in a single file
+    #
+    
+    if args.rounds != None:
+        import epp_rounds as rd
+        filenames = args.rounds
+        if args.fichier_csv != None:
+            filenames = [args.fichier_csv] + filenames
+        # -r swallows the files that follow it: catch an output file given after the rounds
+        for filename in filenames:
+            if filename.lower().endswith("." + args.format) and args.format != "csv":
+                parser.error(f"{filename} n'est pas un export csv: utilisez -o pour le fichier produit")
+        for filename in filenames:
+            if not os.path.exists(filename):
+                raise NameError("Fichier invalide: " + filename)
+        if args.weights != None and len(args.weights) != len(filenames):
+            parser.error(f"{len(filenames)} poids attendus (un par ronde)")
+        if args.output != None and args.fichier_xlsx != None:
+            parser.error("le fichier produit est donné deux fois (fichier_xlsx et -o)")
+        if args.output != None:
+            output_filename = args.output
+        elif args.fichier_xlsx != None:
+            output_filename = args.fichier_xlsx
+        else:
+            output_filename = rd.default_output(filenames, args.format)
+        if is_input(output_filename, filenames):
+            parser.error("le fichier produit serait un des fichiers csv lus: " + output_filename)
+        for n, filename in enumerate(filenames, 1):
+            print(f"Ronde {n}: " + filename)
+        rd.aggregate(filenames, output_filename, min, max, args.weights, args.format, args.unsorted, not args.no_cache, args.jobs[0])
+        print("Fichier produit: " + output_filename)
+        sys.exit(0)
+    
+    input_filename = args.fichier_csv
+    
+    # check if the input csv file exists
+    if os.path.exists(input_filename):
+        # use a specific output file if it was specified on the command line
+        if args.fichier_xlsx == None:
+            output_filename = default_output(input_filename, args.format)
+        else:
+            output_filename = args.fichier_xlsx
+    else:
+        raise NameError("Fichier invalide: " + input_filename)
+    
+    # never overwrite the export
+    if is_input(output_filename, [input_filename]):
+        parser.error("le fichier produit serait le fichier csv lu: " + output_filename)
+    
+    # measure each stage (see epp_stats). tracemalloc slows down every allocation:
+    # memory is only traced on request, so that the times are not distorted
+    if args.profile or args.profile_memory or args.profile_json != None:
+        import tracemalloc
+        import epp_stats as st
+        collector = st.Collector()
+        st.add_hook(collector)
+        if args.profile_memory:
+            tracemalloc.start()
+    else:
+        collector = None
+    
     #
     # Read and process the input file
     #
     
     print("Fichier lu: " + input_filename)
     
-    # clean csv file
-    r.clean_csv(input_filename, temp_filename)
-
-    # read cleaned file into memory (rows)
-    rows = r.read_csv(temp_filename)
-    os.remove(temp_filename)
-    
-    # parse rows and build epp data structure
-    epp = r.parse(rows)
-    epp.compute(min, max)
+    # stream the csv file (non-printable characters are removed on the fly and counted
+    # by line in stripped), parse rows and build epp data structure (unless it is
+    # already in the cache)
+    stripped = {}
+    tree = False
+    if args.parallel:
+        # columnar arrays, computed by ranges of teams in a process pool (see epp_parallel)
+        import epp_columnar as col
+        import epp_parallel as p
+        c = read_columnar(input_filename, args.unsorted, not args.no_cache, args.mmap, stripped)
+        p.compute(c, min, max, args.jobs[0])
+        teams = col.summary_teams(c)
+    elif args.no_cache and not args.unsorted:
+        # without the cache, a sorted file is read, computed and written one team at a time
+        teams = stream_teams(input_filename, min, max, args.mmap, stripped)
+    else:
+        teams = read_epp(input_filename, args.unsorted, not args.no_cache, args.mmap, stripped)
+        teams.compute(min, max)
+        tree = True
     
     #
-    # Write results in Excel format
+    # Write results in Excel format (or csv, json)
     #
     
     if args.verbose:
-        print(epp)    
+        if tree:
+            print(teams)
+        else:
+            teams = list(teams)
+            for team in teams:
+                print(team)
     
     print("Fichier produit: " + output_filename)
-    w.write_xlsx(output_filename, epp)
+    write_epp(output_filename, teams, args.format, args.streaming)
+    
+    # the BOM of the export is one of them (line 1)
+    if len(stripped) > 0 and (args.verbose or collector != None):
+        lines = sorted(stripped)
+        shown = ", ".join(str(line) for line in lines[:10]) + (", ..." if len(lines) > 10 else "")
+        print(f"Caractères non imprimables retirés: {sum(stripped.values())} sur {len(lines)} ligne(s) (lignes {shown})")
+    
+    if collector != None:
+        if args.profile_memory:
+            tracemalloc.stop()
+        print()
+        print(collector.report())
+        stages = [record["stage"] for record in collector.records]
+        if "parse" in stages and "read" not in stages:
+            print("Note: le fichier csv est nettoyé et lu pendant l'analyse: l'étape parse inclut le nettoyage et la lecture")
+        elif "parse" not in stages and "compute" not in stages:
+            print("Note: les équipes sont lues, analysées et calculées une à une pendant l'écriture: l'étape write inclut ces étapes")
+        if args.profile_json != None:
+            collector.write_json(args.profile_json[0])
+            print("Mesures produites: " + args.profile_json[0])
     
     print("Traitement terminé avec succès")
\ No newline at end of file
@@ -0,0 +1,4 @@
+""" Benchmarks of the EPP reader, model and writer.
+    generate.py writes synthetic Workshop ÉTS exports, run.py times each stage of the
+    pipeline on exports of increasing size. Run from the repository root:
+         $ python3 -m benchmarks.run --rows 1000 10000 100000 -o bench.json """
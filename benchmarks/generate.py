@@ -0,0 +1,75 @@
+import random
+import argparse as ap
+
+""" Generator of synthetic Workshop ÉTS exports ('Export des évaluations (sans multiligne)').
+    The files have the exact format expected by epp_reader: UTF-8 with BOM, semicolon
+    separated, one row per (evaluated, evaluator, aspect), rows grouped by team, evaluated
+    and evaluator. Every student of a team evaluates every student of the team (self
+    evaluation included). """
+
+HEADER = ["Groupe", "Nom_évalué", "Prenom_évalué", "Courriel_évalué", "Bareme", "Note_aspect",
+          "Note_calc", "Note_modif", "Note", "MNG", "Facteur", "Commentaires",
+          "Nom_évaluateur", "Prenom_évaluateur", "Commentaires_generaux"]
+
+ASPECTS = ["Organisation du travail d’équipe", "Composition avec les différences individuelles",
+           "Aptitude à proposer des solutions", "Esprit d’équipe", "Présence",
+           "Quantité de travail", "Qualité du travail"]
+
+# characters that Workshop ÉTS sometimes leaves in its exports (removed by epp_reader)
+NON_PRINTABLE = ["\x0b", "\u200b", "\xa0", "\x7f", "\t"]
+
+
+def rows_per_team(team_size: int, n_aspects: int) -> int:
+    return team_size * team_size * n_aspects
+
+
+def write_export(filename: str, n_teams: int, team_size: int = 5, n_aspects: int = 7,
+                 override_rate: float = 0.02, noise_rate: float = 0.01, seed: int = 0) -> int:
+    """ write a synthetic export and return the number of data rows written.
+    - override_rate: fraction of evaluated students with an overridden note (Note_modif)
+    - noise_rate:    fraction of rows in which a non-printable character is injected """
+
+    rnd = random.Random(seed)
+    aspects = [ASPECTS[a % len(ASPECTS)] + ("" if a < len(ASPECTS) else f" {a}") for a in range(n_aspects)]
+    n_rows = 0
+
+    with open(filename, "wt", encoding = "utf-8-sig", newline = "") as f:
+        f.write(";".join(HEADER) + "\n")
+        for t in range(n_teams):
+            team = f"EQUIPE{t + 1}_BENCH"
+            students = [f"etudiant{t * team_size + i + 1}" for i in range(team_size)]
+            # each evaluator has a personal bias, so that factors differ within a team
+            bias = [rnd.randint(-1, 1) for _ in students]
+            for evaluated in students:
+                modified = rnd.randrange(1, 101) if rnd.random() < override_rate else 0
+                for j, evaluator in enumerate(students):
+                    comment = f'"{evaluator} évalue {evaluated}"'
+                    for aspect in aspects:
+                        score = min(5, max(1, 3 + bias[j] + rnd.randint(-1, 1)))
+                        fields = [team, evaluated, evaluated, evaluated + "@etsmtl.ca", f'"{aspect}"',
+                                  str(score), "50", str(modified), "50", "50,00", "1,000000",
+                                  comment, evaluator, evaluator, '"Commentaire general&nbsp;"']
+                        line = ";".join(fields)
+                        if rnd.random() < noise_rate:
+                            i = rnd.randrange(len(line))
+                            line = line[:i] + rnd.choice(NON_PRINTABLE) + line[i:]
+                        f.write(line + "\n")
+                        n_rows += 1
+
+    return n_rows
+
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description = "Génère un export synthétique du Workshop ÉTS (.csv)")
+    parser.add_argument('fichier_csv', help = 'fichier csv produit')
+    parser.add_argument('-t', '--teams', type = int, default = 10, help = 'nombre d\'équipes')
+    parser.add_argument('-s', '--team-size', type = int, default = 5, help = 'nombre d\'étudiants par équipe')
+    parser.add_argument('-a', '--aspects', type = int, default = 7, help = 'nombre d\'aspects évalués')
+    parser.add_argument('--override-rate', type = float, default = 0.02, help = 'proportion des notes modifiées (Note_modif)')
+    parser.add_argument('--noise-rate', type = float, default = 0.01, help = 'proportion des lignes contenant un caractère non imprimable')
+    parser.add_argument('--seed', type = int, default = 0, help = 'germe du générateur aléatoire')
+    args = parser.parse_args()
+
+    n = write_export(args.fichier_csv, args.teams, args.team_size, args.aspects,
+                     args.override_rate, args.noise_rate, args.seed)
+    print(f"{n} lignes écrites dans {args.fichier_csv}")
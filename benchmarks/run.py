@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import argparse as ap
+
+import epp_reader as r
+import epp_writer as w
+from benchmarks import generate as g
+
+""" Benchmark runner: times each stage of the EPP pipeline (clean_csv, read_csv, parse,
+    EPP.compute and write_xlsx) on synthetic exports of increasing size and records the
+    wall time, throughput and peak memory of every stage to a JSON file, so that results
+    can be compared across versions.
+    Peak memory is measured with tracemalloc in a second, separate run of each stage,
+    so that tracing does not distort the timings. """
+
+
+def run_stage(function, measure_memory: bool) -> tuple:
+    """ run function twice (timed, then traced) and return (result, seconds, peak bytes) """
+
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if measure_memory:
+        del result
+        tracemalloc.start()
+        result = function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return (result, seconds, peak)
+
+
+def bench(n_rows: int, team_size: int, n_aspects: int, override_rate: float, noise_rate: float,
+          min_scale: int, max_scale: int, measure_memory: bool, directory: str) -> list:
+    """ benchmark every stage on an export of about n_rows rows and return one result per stage """
+
+    n_teams = max(1, n_rows // g.rows_per_team(team_size, n_aspects))
+    csv_filename = os.path.join(directory, f"bench_{n_rows}.csv")
+    tmp_filename = os.path.join(directory, f"bench_{n_rows}.tmp")
+    xlsx_filename = os.path.join(directory, f"bench_{n_rows}.xlsx")
+    rows_written = g.write_export(csv_filename, n_teams, team_size, n_aspects, override_rate, noise_rate)
+    file_bytes = os.path.getsize(csv_filename)
+
+    stages = []
+
+    def record(stage: str, seconds: float, peak: int) -> None:
+        stages.append({
+            "rows": rows_written,
+            "teams": n_teams,
+            "stage": stage,
+            "seconds": seconds,
+            "rows_per_second": rows_written / seconds if seconds > 0 else None,
+            "mb_per_second": file_bytes / 1e6 / seconds if seconds > 0 else None,
+            "peak_bytes": peak})
+        print(f"{rows_written:>10} lignes  {stage:<8} {seconds:10.3f} s")
+
+    _, seconds, peak = run_stage(lambda: r.clean_csv(csv_filename, tmp_filename), measure_memory)
+    record("clean", seconds, peak)
+
+    rows, seconds, peak = run_stage(lambda: r.read_csv(tmp_filename), measure_memory)
+    record("read", seconds, peak)
+
+    epp, seconds, peak = run_stage(lambda: r.parse(rows), measure_memory)
+    record("parse", seconds, peak)
+    del rows
+
+    _, seconds, peak = run_stage(lambda: epp.compute(min_scale, max_scale), measure_memory)
+    record("compute", seconds, peak)
+
+    _, seconds, peak = run_stage(lambda: w.write_xlsx(xlsx_filename, epp), measure_memory)
+    record("write", seconds, peak)
+
+    for filename in (csv_filename, tmp_filename, xlsx_filename):
+        os.remove(filename)
+
+    return stages
+
+
+def version() -> str:
+    """ return the current git commit of the repository, or 'unknown' """
+
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True,
+                             cwd = os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description = "Mesure la performance de chaque étape du traitement EPP")
+    parser.add_argument('--rows', type = int, nargs = '+', default = [1000, 10000, 100000], help = 'nombre approximatif de lignes des exports générés (ex. 1000 ... 10000000)')
+    parser.add_argument('--team-size', type = int, default = 5, help = 'nombre d\'étudiants par équipe')
+    parser.add_argument('--aspects', type = int, default = 7, help = 'nombre d\'aspects évalués')
+    parser.add_argument('--override-rate', type = float, default = 0.02, help = 'proportion des notes modifiées (Note_modif)')
+    parser.add_argument('--noise-rate', type = float, default = 0.01, help = 'proportion des lignes contenant un caractère non imprimable')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'ne mesure pas la mémoire (plus rapide)')
+    parser.add_argument('-o', '--output', default = 'bench.json', help = 'fichier json produit')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n_rows in args.rows:
+            results += bench(n_rows, args.team_size, args.aspects, args.override_rate, args.noise_rate,
+                             1, 5, not args.no_memory, directory)
+
+    report = {
+        "version": version(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "results": results}
+    with open(args.output, "wt") as f:
+        json.dump(report, f, indent = 2)
+    print("Fichier produit: " + args.output)
@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import argparse as ap
+
+import epp_reader as r
+import epp_server as sv
+from benchmarks import generate as g
+
+""" Localhost check of epp_server. A Server is started on a free port (Server.start(port=0))
+    and driven by clients that, like curl, read each response until the server closes the
+    connection (EOF). Every request must complete within --timeout seconds: a worker process
+    that inherited a client socket would keep the connection open and the client would hang.
+    The JSON responses are compared with epp_server.summary() computed locally.
+    Exits with status 1 if a request fails. Run from the repository root:
+         $ python3 -m benchmarks.server """
+
+
+async def request(port: int, method: str, target: str, body: bytes = b"", length: int = None) -> tuple:
+    """ send a request, read the response until EOF and return (status, body).
+    The Content-Length header is length (by default, the length of body), and is omitted
+    if length is negative. The connection is half-closed once body is sent. """
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    if length is None:
+        length = len(body)
+    header = f"{method} {target} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+    if length >= 0:
+        header += f"Content-Length: {length}\r\n"
+    writer.write(header.encode("ascii") + b"\r\n" + body)
+    await writer.drain()
+    writer.write_eof()
+    response = await reader.read()
+    writer.close()
+
+    head, _, content = response.partition(b"\r\n\r\n")
+    return (int(head.split()[1]), content)
+
+
+async def check(csv_filename: str, jobs: int, clients: int, timeout: float) -> int:
+    """ run every scenario and return the number of failures """
+
+    with open(csv_filename, "rb") as f:
+        data = f.read()
+    epp = r.parse_records(r.stream_records(csv_filename))
+    epp.compute(1, 5)
+    expected = sv.summary(epp, 1, 5)
+
+    def json_ok(status: int, content: bytes) -> bool:
+        return status == 200 and json.loads(content) == expected
+
+    # the first request is the one served while the pool starts its workers
+    scenarios = [
+        ("first json", [("POST", "/json?course=ELE400", data)], json_ok),
+        ("health", [("GET", "/health", b"")], lambda status, content: status == 200 and content == b"ok"),
+        ("xlsx", [("POST", "/xlsx?min=1&max=5", data)], lambda status, content: status == 200 and content[:2] == b"PK"),
+        ("concurrent json", [("POST", "/json?course=ELE400", data)] * clients, json_ok),
+        ("invalid csv", [("POST", "/json", b"a;b\n1;2\n")], lambda status, content: status == 400),
+        ("unknown path", [("GET", "/csv", b"")], lambda status, content: status == 404),
+        ("no length", [("POST", "/json", b"", -1)], lambda status, content: status == 411),
+        ("truncated body", [("POST", "/json", data[:1000], len(data))], lambda status, content: status == 400),
+    ]
+
+    server = sv.Server(jobs)
+    port = await server.start(port = 0)
+    failures = 0
+    try:
+        for name, requests, expect in scenarios:
+            start = time.perf_counter()
+            try:
+                responses = await asyncio.wait_for(
+                    asyncio.gather(*[request(port, *args) for args in requests]), timeout)
+                failed = not all(expect(status, content) for status, content in responses)
+                note = ""
+            except asyncio.TimeoutError:
+                failed = True
+                note = f"aucune réponse complète après {timeout} s"
+            failures += failed
+            status = "ÉCHEC" if failed else "OK"
+            print(f"{status:<6} {name:<16} {(time.perf_counter() - start) * 1000:8.1f} ms  {note}")
+    finally:
+        await server.close()
+    return failures
+
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description = "Vérifie epp_server sur localhost (port libre choisi automatiquement)")
+    parser.add_argument('-j', '--jobs', type = int, default = 2, help = 'nombre de processus du serveur (défaut: 2)')
+    parser.add_argument('--clients', type = int, default = 4, help = 'nombre de requêtes simultanées (défaut: 4)')
+    parser.add_argument('--timeout', type = float, default = 30.0, help = 'délai maximal de chaque scénario en secondes (défaut: 30)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_filename = os.path.join(directory, "server.csv")
+        g.write_export(csv_filename, 20)
+        failures = asyncio.run(check(csv_filename, args.jobs, args.clients, args.timeout))
+    sys.exit(1 if failures > 0 else 0)
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import argparse as ap
+
+from benchmarks import generate as g
+
+""" Start-up time benchmark of EPP.py, based on 'python -X importtime'.
+    Each scenario runs EPP.py in a fresh interpreter and records the wall time, the total
+    import time and the modules imported. A scenario fails (exit status 1) when it imports
+    a module it should not need (ex. openpyxl for -h or for csv output) or when its import
+    time exceeds --max-import-ms, or when EPP.py does not end as expected: exit
+    status 0 and an output file for the conversions, 2 (argparse error) for the argument
+    error. Run from the repository root:
+         $ python3 -m benchmarks.startup """
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EPP = os.path.join(ROOT, "EPP.py")
+
+
+def scenarios(csv_filename: str, directory: str) -> list:
+    """ return (name, EPP.py arguments, modules that must not be imported, expected exit
+    status, output file that must be produced or None) """
+
+    heavy = ["openpyxl", "numpy", "concurrent.futures", "multiprocessing"]
+    outputs = {format: os.path.join(directory, "out." + format) for format in ("csv", "json", "xlsx")}
+    return [
+        ("help", ["-h"], heavy + ["epp_reader", "epp_model"], 0, None),
+        ("argument error", [], heavy + ["epp_reader", "epp_model"], 2, None),
+        ("csv output", ["--no-cache", "-f", "csv", csv_filename, outputs["csv"]], heavy, 0, outputs["csv"]),
+        ("json output", ["--no-cache", "-f", "json", csv_filename, outputs["json"]], heavy, 0, outputs["json"]),
+        ("xlsx output", ["--no-cache", csv_filename, outputs["xlsx"]], ["concurrent.futures", "multiprocessing"], 0, outputs["xlsx"]),
+    ]
+
+
+def run(arguments: list) -> tuple:
+    """ run EPP.py with -X importtime and return (wall time, import time in us, imported
+    modules, exit status) """
+
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-X", "importtime", EPP] + arguments,
+                         capture_output = True, text = True, cwd = ROOT)
+    wall = time.perf_counter() - start
+
+    total = 0
+    modules = set()
+    for line in out.stderr.splitlines():
+        # import time:   self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        # top-level imports are not indented: their cumulative times add up to the total
+        if not name.startswith("  "):
+            total += int(cumulative)
+    return (wall, total, modules, out.returncode)
+
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description = "Mesure le temps de démarrage de EPP.py (python -X importtime)")
+    parser.add_argument('--max-import-ms', type = float, default = None, help = 'échec si le temps d\'importation d\'un scénario dépasse cette valeur')
+    parser.add_argument('-o', '--output', default = None, help = 'fichier json produit (optionnel)')
+    args = parser.parse_args()
+
+    results = []
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        csv_filename = os.path.join(directory, "startup.csv")
+        g.write_export(csv_filename, 2)
+        for name, arguments, forbidden, expected, output in scenarios(csv_filename, directory):
+            wall, total, modules, returncode = run(arguments)
+            imported = sorted(m for m in forbidden if m in modules)
+            problems = list(imported)
+            if returncode != expected:
+                problems.append(f"code de sortie {returncode} (attendu: {expected})")
+            if output != None and not os.path.exists(output):
+                problems.append("aucun fichier produit")
+            failed = len(problems) > 0 or (args.max_import_ms != None and total / 1000 > args.max_import_ms)
+            failures += failed
+            results.append({"scenario": name, "wall": wall, "import_us": total, "forbidden_imported": imported,
+                            "returncode": returncode})
+            status = "ÉCHEC" if failed else "OK"
+            print(f"{status:<6} {name:<16} {wall * 1000:8.1f} ms  importations {total / 1000:8.1f} ms  {' '.join(problems)}")
+
+    if args.output != None:
+        with open(args.output, "wt") as f:
+            json.dump(results, f, indent = 2)
+    sys.exit(1 if failures > 0 else 0)
@@ -0,0 +1,153 @@
+import os
+import glob
+import pickle
+import hashlib
+import epp_model as m
+import epp_reader as r
+import epp_stats as st
+
+""" On-disk cache of parsed EPP structures.
+    Re-running the program on the same export (for example with another -min/-max scale)
+    does not need to clean, read and parse the csv file again: the EPP tree produced by
+    the parser is pickled in a cache directory, keyed by a hash of the csv file content,
+    the parser version and the parse mode. A cached EPP only needs EPP.compute().
+
+    The cache is bounded in size: once the total size of the entries and remembered keys
+    (see stat_key()) exceeds max_bytes, the least recently used ones are removed.
+
+    Hashing a large export still reads it. stat_key() remembers the key of each file with
+    its size and modification time, so that a file that has not changed since the last run
+    is not read at all. """
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".epp_cache")
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+SUFFIX = ".epp"
+KEY_SUFFIX = ".key"
+
+
+def file_key(filename: str, mode: str = "") -> str:
+    """ return the cache key of a csv file: a hash of its content, the parser version and mode """
+
+    h = hashlib.sha256()
+    h.update(f"{r.PARSER_VERSION};{mode};".encode())
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stat_key(filename: str, mode: str = "", directory: str = DEFAULT_DIRECTORY) -> str:
+    """ same as file_key(), but the key is remembered in directory along with the size and
+    modification time of the file: the file is only hashed again once it has changed """
+
+    path = os.path.abspath(filename)
+    info = os.stat(path)
+    stamp = f"{r.PARSER_VERSION};{mode};{info.st_size};{info.st_mtime_ns}"
+    memo = os.path.join(directory, hashlib.sha256(f"{path};{mode}".encode()).hexdigest() + KEY_SUFFIX)
+    try:
+        with open(memo, "rt") as f:
+            saved_stamp, key = f.read().split("\n")[:2]
+        if saved_stamp == stamp:
+            # mark the key as recently used (see evict())
+            os.utime(memo)
+            return key
+    except (FileNotFoundError, ValueError):
+        pass
+
+    key = file_key(filename, mode)
+    os.makedirs(directory, exist_ok = True)
+    temp_path = f"{memo}.{os.getpid()}.tmp"
+    with open(temp_path, "wt") as f:
+        f.write(stamp + "\n" + key + "\n")
+    os.replace(temp_path, memo)
+    return key
+
+
+def load(key: str, directory: str = DEFAULT_DIRECTORY) -> m.EPP:
+    """ return the EPP stored under key, or None if it is not in the cache """
+
+    path = os.path.join(directory, key + SUFFIX)
+    try:
+        # mark the entry as recently used. Inside the try: another process may evict it
+        os.utime(path)
+        with open(path, "rb") as f:
+            epp = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # corrupted or incompatible entry
+        remove(path)
+        return None
+    return epp
+
+
+def store(key: str, epp: m.EPP, directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+    """ store epp under key, then evict old entries if the cache exceeds max_bytes.
+    An entry larger than max_bytes is not stored: it would evict every other entry,
+    then itself. """
+
+    os.makedirs(directory, exist_ok = True)
+    path = os.path.join(directory, key + SUFFIX)
+
+    # write to a temporary file first so that concurrent readers never see a partial entry
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(epp, f, protocol = pickle.HIGHEST_PROTOCOL)
+        size = f.tell()
+    if size > max_bytes:
+        remove(temp_path)
+        return
+    os.replace(temp_path, path)
+
+    evict(directory, max_bytes)
+
+
+def evict(directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+    """ remove the least recently used entries and remembered keys until the cache size
+    is at most max_bytes. A removed key file only costs hashing its csv file again. """
+
+    entries = []
+    for suffix in (SUFFIX, KEY_SUFFIX):
+        for path in glob.glob(os.path.join(directory, "*" + suffix)):
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        remove(path)
+        total -= size
+
+
+def clear(directory: str = DEFAULT_DIRECTORY) -> None:
+    """ remove every entry (and remembered key) from the cache """
+
+    for suffix in (SUFFIX, KEY_SUFFIX):
+        for path in glob.glob(os.path.join(directory, "*" + suffix)):
+            remove(path)
+
+
+def remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def cached_parse(filename: str, parse, mode: str = "", directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES) -> m.EPP:
+    """ return the EPP of a csv file from the cache, or build it with parse(filename)
+    and store it in the cache. mode distinguishes parse functions (ex. sorted/unsorted). """
+
+    with st.stage("cache") as counts:
+        key = stat_key(filename, mode, directory)
+        epp = load(key, directory)
+        counts["hit"] = epp is not None
+    if epp is None:
+        epp = parse(filename)
+        store(key, epp, directory, max_bytes)
+    return epp
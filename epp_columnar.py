@@ -0,0 +1,298 @@
+import numpy as np
+import epp_model as m
+import epp_stats as st
+
+""" Columnar representation of a peer evaluation (epp).
+    Instead of a tree of Team, Evaluated and Evaluator objects, the scores are kept in
+    contiguous NumPy arrays and the tree structure is described by index arrays:
+        - score_evaluator[i]:     evaluator that gave score i
+        - evaluator_evaluated[j]: evaluated student that owns evaluator j
+        - evaluated_team[k]:      team that owns evaluated student k
+    compute() then derives evaluator scores, notes, team averages (MNG) and factors with
+    a few grouped reductions instead of nested Python loops. The results are identical
+    to EPP.compute() (np.bincount accumulates in the same order as the Python loops).
+
+    from_epp() and to_epp() convert between the two representations, so that
+    epp_writer can be used on the result. from_records() builds the arrays directly from
+    the csv records, without the tree, and summary_teams() yields the computed teams in
+    the form expected by epp_writer, without rebuilding the evaluators.
+    select_teams() extracts a range of teams (see epp_parallel).
+
+    Note: to use this module, you may have to install the 'numpy' Python library:
+         $ pip install numpy """
+
+
+class ColumnarEPP:
+    """ Columnar peer evaluation.
+    ColumnarEPP attributes are:
+    - scores:              aspect scores (one entry per csv row that is not overridden)
+    - score_evaluator:     index of the evaluator that gave each score
+    - evaluator_evaluated: index of the evaluated student of each evaluator
+    - evaluated_team:      index of the team of each evaluated student
+    - team_names:          team names
+    - evaluated_last_names, evaluated_surnames, evaluated_emails: evaluated students identity
+    - evaluator_last_names, evaluator_surnames: evaluators identity
+    - modified:            boolean array, True if the evaluated student note was overridden
+    - modified_notes:      overridden notes (meaningful only where modified is True)
+    - override_sources:    Evaluated.override_source of each evaluated student
+    - evaluator_scores, notes, factors, averages: results of compute() """
+
+    def __init__(self):
+        self.scores = np.zeros(0, dtype=np.int16)
+        self.score_evaluator = np.zeros(0, dtype=np.intp)
+        self.evaluator_evaluated = np.zeros(0, dtype=np.intp)
+        self.evaluated_team = np.zeros(0, dtype=np.intp)
+        self.team_names = []
+        self.evaluated_last_names = []
+        self.evaluated_surnames = []
+        self.evaluated_emails = []
+        self.evaluator_last_names = []
+        self.evaluator_surnames = []
+        self.modified = np.zeros(0, dtype=bool)
+        self.modified_notes = np.zeros(0)
+        self.override_sources = []
+        self.evaluator_scores = np.zeros(0)
+        self.notes = np.zeros(0)
+        self.factors = np.zeros(0)
+        self.averages = np.zeros(0)
+
+    def compute(self, min_scale: int, max_scale: int) -> None:
+        """ compute evaluator scores, evaluated notes, team averages and factors.
+        See Evaluator.compute() for the meaning of the offset. """
+
+        offset = 0.0 if min_scale == 1 else 1.0
+        n_evaluators = len(self.evaluator_evaluated)
+        n_evaluated = len(self.evaluated_team)
+        n_teams = len(self.team_names)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # evaluator scores, normalized to 100
+            counts = np.bincount(self.score_evaluator, minlength=n_evaluators)
+            totals = np.bincount(self.score_evaluator, weights=self.scores - offset, minlength=n_evaluators)
+            scores = totals * 100.0 / (max_scale * counts)
+            # evaluators of an overridden student are never computed
+            self.evaluator_scores = np.where(self.modified[self.evaluator_evaluated], 0.0, scores)
+
+            # evaluated notes: average of evaluator scores, unless overridden
+            counts = np.bincount(self.evaluator_evaluated, minlength=n_evaluated)
+            totals = np.bincount(self.evaluator_evaluated, weights=self.evaluator_scores, minlength=n_evaluated)
+            self.notes = np.where(self.modified, self.modified_notes, totals / counts)
+
+            # team averages and factors
+            counts = np.bincount(self.evaluated_team, minlength=n_teams)
+            totals = np.bincount(self.evaluated_team, weights=self.notes, minlength=n_teams)
+            self.averages = totals / counts
+            self.factors = self.notes / self.averages[self.evaluated_team]
+
+    def __len__(self) -> int:
+        return len(self.team_names)
+
+
+def from_epp(epp: m.EPP) -> ColumnarEPP:
+    """ build a ColumnarEPP from an EPP structure (normally produced by epp_reader.parse()) """
+
+    c = ColumnarEPP()
+    scores = []
+    score_evaluator = []
+    evaluator_evaluated = []
+    evaluated_team = []
+    modified = []
+    modified_notes = []
+
+    for team in epp:
+        team_index = len(c.team_names)
+        c.team_names.append(team.name)
+        for evaluated in team:
+            evaluated_index = len(evaluated_team)
+            evaluated_team.append(team_index)
+            c.evaluated_last_names.append(evaluated.last_name)
+            c.evaluated_surnames.append(evaluated.surname)
+            c.evaluated_emails.append(evaluated.email)
+            modified.append(evaluated.modified)
+            modified_notes.append(evaluated.note if evaluated.modified else 0.0)
+            c.override_sources.append(evaluated.override_source)
+            for evaluator in evaluated:
+                evaluator_index = len(evaluator_evaluated)
+                evaluator_evaluated.append(evaluated_index)
+                c.evaluator_last_names.append(evaluator.last_name)
+                c.evaluator_surnames.append(evaluator.surname)
+                scores.extend(evaluator)
+                score_evaluator.extend([evaluator_index] * len(evaluator))
+
+    c.scores = np.array(scores, dtype=np.int16)
+    c.score_evaluator = np.array(score_evaluator, dtype=np.intp)
+    c.evaluator_evaluated = np.array(evaluator_evaluated, dtype=np.intp)
+    c.evaluated_team = np.array(evaluated_team, dtype=np.intp)
+    c.modified = np.array(modified, dtype=bool)
+    c.modified_notes = np.array(modified_notes, dtype=float)
+    return c
+
+
+def to_epp(c: ColumnarEPP) -> m.EPP:
+    """ build an EPP structure from a ColumnarEPP.
+    Computed values (score, note, average, factor) are copied if compute() was called. """
+
+    computed = len(c.notes) == len(c.evaluated_team)
+    scores = c.scores.tolist()
+    score_evaluator = c.score_evaluator.tolist()
+
+    epp = m.EPP()
+    teams = []
+    for name in c.team_names:
+        team = m.Team(name)
+        epp.append(team)
+        teams.append(team)
+
+    evaluated_list = []
+    for k, team_index in enumerate(c.evaluated_team.tolist()):
+        evaluated = m.Evaluated(c.evaluated_last_names[k], c.evaluated_surnames[k], c.evaluated_emails[k])
+        if c.modified[k]:
+            evaluated.modify(float(c.modified_notes[k]), c.override_sources[k])
+        teams[team_index].append(evaluated)
+        evaluated_list.append(evaluated)
+
+    evaluators = []
+    for j, evaluated_index in enumerate(c.evaluator_evaluated.tolist()):
+        evaluator = m.Evaluator(c.evaluator_last_names[j], c.evaluator_surnames[j])
+        evaluated_list[evaluated_index].append(evaluator)
+        evaluators.append(evaluator)
+
+    for score, evaluator_index in zip(scores, score_evaluator):
+        evaluators[evaluator_index].append(score)
+
+    if computed:
+        for evaluator, score in zip(evaluators, c.evaluator_scores.tolist()):
+            evaluator.score = score
+        for evaluated, note, factor in zip(evaluated_list, c.notes.tolist(), c.factors.tolist()):
+            evaluated.note = note
+            evaluated.factor = factor
+        for team, average in zip(teams, c.averages.tolist()):
+            team.average = average
+
+    return epp
+
+
+def from_records(rows) -> ColumnarEPP:
+    """ build a ColumnarEPP from records (see epp_reader.read_records()) without building
+    an EPP tree. The rows of a team must be contiguous and the rules are those of
+    epp_reader.parse_team_records(), so that the result is identical to
+    from_epp(epp_reader.parse_records(rows)). """
+
+    with st.stage("parse") as counts:
+        c = ColumnarEPP()
+        scores = []
+        score_evaluator = []
+        evaluator_evaluated = []
+        evaluated_team = []
+        modified = []
+        modified_notes = []
+
+        last_team = None
+        last_evaluated = None
+        last_evaluator = None
+        last_modif = None
+        evaluator_index = -1
+
+        for group, last_name, surname, email, evaluator_last_name, evaluator_surname, note_modif, note_aspect, line in rows:
+            team_added = False
+            evaluated_added = False
+
+            if last_team != group:
+                last_team = group
+                c.team_names.append(group)
+                team_added = True
+
+            if team_added or last_evaluated != (last_name, surname):
+                last_evaluated = (last_name, surname)
+                evaluated_team.append(len(c.team_names) - 1)
+                c.evaluated_last_names.append(last_name)
+                c.evaluated_surnames.append(surname)
+                c.evaluated_emails.append(email)
+                modified.append(False)
+                modified_notes.append(0.0)
+                c.override_sources.append(None)
+                evaluated_added = True
+
+            if note_modif != last_modif:
+                last_modif = note_modif
+                modified_note = float(note_modif)
+
+            # same rules as epp_reader.override(): the last value wins and the evaluators
+            # of an overridden student are not built
+            if modified_note > 0.0:
+                if not modified[-1] or modified_notes[-1] != modified_note:
+                    modified[-1] = True
+                    modified_notes[-1] = modified_note
+                    c.override_sources[-1] = line
+                continue
+            if modified[-1]:
+                continue
+
+            if team_added or evaluated_added or last_evaluator != (evaluator_last_name, evaluator_surname):
+                last_evaluator = (evaluator_last_name, evaluator_surname)
+                evaluator_index = len(evaluator_evaluated)
+                evaluator_evaluated.append(len(evaluated_team) - 1)
+                c.evaluator_last_names.append(evaluator_last_name)
+                c.evaluator_surnames.append(evaluator_surname)
+
+            scores.append(int(note_aspect))
+            score_evaluator.append(evaluator_index)
+
+        c.scores = np.array(scores, dtype=np.int16)
+        c.score_evaluator = np.array(score_evaluator, dtype=np.intp)
+        c.evaluator_evaluated = np.array(evaluator_evaluated, dtype=np.intp)
+        c.evaluated_team = np.array(evaluated_team, dtype=np.intp)
+        c.modified = np.array(modified, dtype=bool)
+        c.modified_notes = np.array(modified_notes, dtype=float)
+        counts["teams"] = len(c.team_names)
+        counts["students"] = len(c.evaluated_team)
+    return c
+
+
+def select_teams(c: ColumnarEPP, start: int, stop: int) -> ColumnarEPP:
+    """ return the teams start to stop - 1 of c as a new ColumnarEPP.
+    The index arrays are in tree order (as built by from_epp() and from_records()), so the
+    teams own contiguous slices of every array: they are found by binary search, not by a
+    walk. The identity lists (names, emails) are not copied. """
+
+    s = ColumnarEPP()
+    first_evaluated, last_evaluated = np.searchsorted(c.evaluated_team, [start, stop])
+    first_evaluator, last_evaluator = np.searchsorted(c.evaluator_evaluated, [first_evaluated, last_evaluated])
+    first_score, last_score = np.searchsorted(c.score_evaluator, [first_evaluator, last_evaluator])
+
+    s.scores = c.scores[first_score:last_score]
+    s.score_evaluator = c.score_evaluator[first_score:last_score] - first_evaluator
+    s.evaluator_evaluated = c.evaluator_evaluated[first_evaluator:last_evaluator] - first_evaluated
+    s.evaluated_team = c.evaluated_team[first_evaluated:last_evaluated] - start
+    s.team_names = c.team_names[start:stop]
+    s.modified = c.modified[first_evaluated:last_evaluated]
+    s.modified_notes = c.modified_notes[first_evaluated:last_evaluated]
+    return s
+
+
+def summary_teams(c: ColumnarEPP):
+    """ generator that yields each computed team of c as an epp_model Team whose Evaluated
+    students hold the note, factor and override but no Evaluator: what epp_writer needs,
+    built one team at a time """
+
+    notes = c.notes.tolist()
+    factors = c.factors.tolist()
+    averages = c.averages.tolist()
+    modified = c.modified.tolist()
+    team = None
+    for k, team_index in enumerate(c.evaluated_team.tolist()):
+        if team is None or team_index != current:
+            if team is not None:
+                yield team
+            current = team_index
+            team = m.Team(c.team_names[team_index])
+            team.average = averages[team_index]
+        evaluated = m.Evaluated(c.evaluated_last_names[k], c.evaluated_surnames[k], c.evaluated_emails[k])
+        if modified[k]:
+            evaluated.modify(notes[k], c.override_sources[k])
+        evaluated.note = notes[k]
+        evaluated.factor = factors[k]
+        team.append(evaluated)
+        team.dirty = False
+    if team is not None:
+        yield team
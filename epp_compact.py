@@ -0,0 +1,175 @@
+import sys
+from array import array
+import epp_model as m
+import epp_reader as r
+
+""" Memory-compact variants of the epp_model classes.
+    The classes below have the same public attributes and methods as their epp_model
+    counterparts (last_name, surname, score, note, factor, modified, average, compute(), ...)
+    so that epp_writer and __repr__ work unchanged, but:
+        - they use __slots__, hence no per-instance __dict__,
+        - an evaluator stores its aspect scores in a typed array('b') (1 byte per score)
+          instead of a list of boxed Python int,
+        - names and emails are interned, so the strings repeated on every csv row
+          (each student appears once per evaluator) are stored only once.
+    They do not track dirty teams: use epp_model if EPP.recompute() is needed.
+
+    parse() builds a CompactEPP directly from csv rows, converting each team as soon as
+    epp_reader.parse_teams() yields it. Run this module to measure the memory savings:
+         $ python3 epp_compact.py """
+
+
+class CompactEvaluator(array):
+    """ Compact version of epp_model.Evaluator: an array of aspect scores (signed bytes) """
+
+    __slots__ = ("last_name", "surname", "score")
+
+    def __new__(cls, last_name: str, surname: str):
+        return super().__new__(cls, "b")
+
+    def __init__(self, last_name: str, surname: str):
+        self.last_name = sys.intern(last_name)
+        self.surname = sys.intern(surname)
+        self.score = 0.0
+
+    def compute(self, min_scale: int, max_scale: int) -> float:
+        # see epp_model.Evaluator.compute() for the offset. Scores are small integers,
+        # so the total is exact and identical to the one accumulated by Evaluator.compute()
+        offset = 0.0 if min_scale == 1 else 1.0
+        total = sum(self) - offset * len(self)
+        self.score = total * 100.0 / (max_scale * len(self))
+        return self.score
+
+    def __repr__(self) -> str:
+        s = f"    Evaluator: {self.last_name}, {self.surname}, score={self.score:0.2f}, {list(self)}\n"
+        return s
+
+
+class CompactEvaluated(list):
+    """ Compact version of epp_model.Evaluated: a list of CompactEvaluator """
+
+    __slots__ = ("last_name", "surname", "email", "modified", "note", "factor", "override_source")
+
+    def __init__(self, last_name: str, surname: str, email: str):
+        super().__init__()
+        self.last_name = sys.intern(last_name)
+        self.surname = sys.intern(surname)
+        self.email = sys.intern(email)
+        self.modified = False
+        self.note = 0.0
+        self.factor = 0.0
+        self.override_source = None
+
+    compute_note = m.Evaluated.compute_note
+    compute_factor = m.Evaluated.compute_factor
+    __repr__ = m.Evaluated.__repr__
+
+    def modify(self, note: float, source: int = None) -> None:
+        self.note = note
+        self.modified = True
+        self.override_source = source
+
+
+class CompactTeam(list):
+    """ Compact version of epp_model.Team: a list of CompactEvaluated """
+
+    __slots__ = ("name", "average")
+
+    def __init__(self, team_name: str):
+        super().__init__()
+        self.name = sys.intern(team_name)
+        self.average = 0.0
+
+    def compute(self, min_scale: int, max_scale: int) -> None:
+        total = 0.0
+        for e in self:
+            total += e.compute_note(min_scale, max_scale)
+
+        self.average = total / len(self)
+
+        for e in self:
+            e.compute_factor(self.average)
+
+    __repr__ = m.Team.__repr__
+
+
+class CompactEPP(list):
+    """ Compact version of epp_model.EPP: a list of CompactTeam """
+
+    __slots__ = ()
+
+    def compute(self, min_scale: int, max_scale: int) -> None:
+        for t in self:
+            t.compute(min_scale, max_scale)
+
+    __repr__ = m.EPP.__repr__
+
+
+def from_team(team: m.Team) -> CompactTeam:
+    """ convert an epp_model Team (and its students) to a CompactTeam """
+
+    t = CompactTeam(team.name)
+    t.average = team.average
+    for evaluated in team:
+        e = CompactEvaluated(evaluated.last_name, evaluated.surname, evaluated.email)
+        e.modified = evaluated.modified
+        e.note = evaluated.note
+        e.factor = evaluated.factor
+        e.override_source = evaluated.override_source
+        for evaluator in evaluated:
+            c = CompactEvaluator(evaluator.last_name, evaluator.surname)
+            c.extend(evaluator)
+            c.score = evaluator.score
+            e.append(c)
+        t.append(e)
+    return t
+
+
+def from_epp(epp: m.EPP) -> CompactEPP:
+    """ convert an epp_model EPP to a CompactEPP """
+
+    return CompactEPP(from_team(t) for t in epp)
+
+
+def parse(rows) -> CompactEPP:
+    """ same as epp_reader.parse(), but builds a CompactEPP.
+    Each team is converted as soon as it is parsed, so that only one epp_model
+    Team is alive at a time. """
+
+    return CompactEPP(from_team(t) for t in r.parse_teams(rows))
+
+
+def measure(n_teams: int = 200, team_size: int = 5, n_aspects: int = 7) -> tuple:
+    """ return the memory used per evaluated student (in bytes) by an epp_model EPP
+    and by a CompactEPP built from the same synthetic csv rows """
+
+    import tracemalloc
+
+    def rows():
+        for t in range(n_teams):
+            for i in range(team_size):
+                for j in range(team_size):
+                    for a in range(n_aspects):
+                        # new strings on every row, as csv.DictReader does
+                        yield {
+                            "Groupe": f"EQUIPE{t}", "Nom_évalué": f"nom{t}_{i}", "Prenom_évalué": f"prenom{t}_{i}",
+                            "Courriel_évalué": f"etudiant{t}_{i}@etsmtl.ca", "Note_modif": "0",
+                            "Nom_évaluateur": f"nom{t}_{j}", "Prenom_évaluateur": f"prenom{t}_{j}",
+                            "Note_aspect": str(1 + (i + j + a) % 5)}
+
+    results = []
+    for build in (r.parse, parse):
+        tracemalloc.start()
+        epp = build(rows())
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del epp
+        results.append(used / (n_teams * team_size))
+    return tuple(results)
+
+
+if __name__ == '__main__':
+    model_bytes, compact_bytes = measure()
+    print(f"epp_model  : {model_bytes:8.0f} octets par étudiant")
+    print(f"epp_compact: {compact_bytes:8.0f} octets par étudiant")
+    print(f"économie   : {100.0 * (1.0 - compact_bytes / model_bytes):8.1f} %")
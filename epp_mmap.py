@@ -0,0 +1,230 @@
+import io
+import os
+import csv
+import mmap
+import locale
+import epp_model as m
+import epp_reader as r
+import epp_stats as st
+
+""" Memory-mapped reader for very large exports.
+    MappedExport maps the csv file in memory instead of reading it. When it is opened,
+    a light scan finds the byte range of each team: it only looks at the first field
+    (Groupe) of each line, and decodes it when it differs from the previous line.
+    Teams are then parsed on demand from their byte range, so that:
+        - memory usage is bounded by the size of a team (the pages of the file are
+          managed by the operating system and are not copied),
+        - a single team can be read without reading the whole file (random access).
+
+        with MappedExport(filename) as export:
+            team = export.find("EQUIPE1_ELE795")
+            for team in export:
+                team.compute(1, 5)
+                ...
+
+    Each team is parsed by epp_reader.parse_team_records(), with the non-printable
+    characters removed as by clean_lines(): the teams are identical to those of
+    epp_reader.parse(). Like parse(), the reader expects the rows of a team to be
+    contiguous (see epp_reader.parse_indexed_records() and MappedExport.records()
+    otherwise). The export being "sans multiligne", rows never span several lines.
+    Lines must end with LF or CR LF. """
+
+
+# number of bytes scanned between two calls to release()
+RELEASE_SIZE = 1 << 24
+
+
+class MappedExport:
+    """ A csv export mapped in memory, seen as a sequence of teams.
+    export[i] and iteration parse the teams on demand: each access builds new Team objects.
+    MappedExport attributes are:
+    - filename:   csv file name
+    - encoding:   encoding of the file (same as open() in text mode)
+    - fieldnames: column names, read from the first line
+    - ranges:     (team name, start offset, end offset) of each team, in file order
+    - index:      {team name: index in ranges}
+    - lines:      {start offset of a range: its line number in the file}
+    - released:   offset below which the pages were released (see release()) """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.encoding = locale.getpreferredencoding(False)
+        self.file = open(filename, "rb")
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            # an empty file cannot be mapped
+            self.map = b""
+        self.fieldnames = []
+        self.ranges = []
+        self.lines = {}
+        self.index = {}
+        self.released = 0
+        self.scan()
+
+    def scan(self) -> None:
+        """ read the header and find the byte range of each team """
+
+        with st.stage("read") as counts:
+            data = self.map
+            end = len(data)
+            position = self.line_end(0)
+            self.fieldnames = next(csv.reader(r.clean_lines([data[:position].decode(self.encoding)]), delimiter=";"), [])
+
+            lines = 0
+            start = position
+            start_line = 2
+            last_key = None
+            name = None
+            while position < end:
+                line_end = self.line_end(position)
+                lines += 1
+                # the first field, or the whole line if the first field is quoted
+                if data[position] == ord('"'):
+                    key = data[position:line_end]
+                else:
+                    semicolon = data.find(b";", position, line_end)
+                    key = data[position:line_end if semicolon < 0 else semicolon]
+                if key != last_key and not data[position:line_end].isspace():
+                    last_key = key
+                    new_name = self.team_name(key)
+                    # the parser compares the cleaned names: a different raw key
+                    # does not always start a new team. A header repeated by
+                    # concatenated exports stays in the current range (see
+                    # epp_reader.read_records())
+                    if new_name != name and not self.is_header(data[position:line_end]):
+                        if name is not None:
+                            self.add_range(name, start, position, start_line)
+                        name = new_name
+                        start = position
+                        start_line = lines + 1
+                position = line_end
+                if position - self.released >= RELEASE_SIZE:
+                    self.release(position)
+            if name is not None:
+                self.add_range(name, start, end, start_line)
+            self.release(end)
+            # the teams are read again from the start
+            self.released = 0
+
+            counts["lines"] = lines
+            counts["teams"] = len(self.ranges)
+
+    def line_end(self, position: int) -> int:
+        """ return the offset following the end of the line starting at position """
+        newline = self.map.find(b"\n", position)
+        return len(self.map) if newline < 0 else newline + 1
+
+    def team_name(self, key: bytes) -> str:
+        """ return the cleaned Groupe value of a raw first field (or quoted line) """
+        text = key.decode(self.encoding)
+        return next(csv.reader(r.clean_lines([text]), delimiter=";"), [""])[0]
+
+    def is_header(self, line: bytes) -> bool:
+        """ True if the raw line is a copy of the header """
+        return next(csv.reader(r.clean_lines([line.decode(self.encoding)]), delimiter=";"), []) == self.fieldnames
+
+    def add_range(self, name: str, start: int, stop: int, line: int) -> None:
+        # a team name may appear twice if the rows are not sorted: index the first one
+        self.index.setdefault(name, len(self.ranges))
+        self.ranges.append((name, start, stop))
+        self.lines[start] = line
+
+    def line_number(self, position: int) -> int:
+        """ return the line number of the line starting at position """
+        line = self.lines.get(position)
+        if line is None:
+            line = self.map[:position].count(b"\n") + 1
+        return line
+
+    def text(self, start: int, stop: int) -> io.StringIO:
+        """ return the decoded lines between the start and stop offsets, with universal
+        newlines as in text mode """
+
+        return io.StringIO(self.map[start:stop].decode(self.encoding), newline = None)
+
+    def rows(self, start: int = None, stop: int = None):
+        """ generator that yields one dictionary per row between the start and stop offsets
+        (by default, the whole file), removing non-printable characters.
+        The whole file is decoded one team range at a time: memory usage stays bounded
+        by the size of a team. """
+
+        for a, b in self.spans(start, stop):
+            for row in csv.DictReader(r.clean_lines(self.text(a, b)), fieldnames = self.fieldnames, delimiter=";"):
+                # a header repeated by concatenated exports
+                if list(row.values()) != self.fieldnames:
+                    yield row
+            self.release(b)
+
+    def records(self, start: int = None, stop: int = None):
+        """ same as rows(), but yields records (see epp_reader.read_records()) """
+
+        for a, b in self.spans(start, stop):
+            yield from r.read_records(self.text(a, b), self.fieldnames, first_line = self.line_number(a))
+            self.release(b)
+
+    def spans(self, start: int = None, stop: int = None) -> list:
+        """ return [(start, stop)], or the range of every team if start and stop are None """
+
+        if start is None and stop is None:
+            return [(a, b) for _, a, b in self.ranges]
+        if start is None:
+            start = self.ranges[0][1] if self.ranges else len(self.map)
+        if stop is None:
+            stop = len(self.map)
+        return [(start, stop)]
+
+    def release(self, stop: int) -> None:
+        """ tell the operating system that the pages before stop will not be needed soon:
+        they no longer count in the resident memory of the process (they stay in the file
+        cache and are read again on the next access) """
+
+        stop -= stop % mmap.PAGESIZE
+        if stop > self.released and isinstance(self.map, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED"):
+            self.map.madvise(mmap.MADV_DONTNEED, self.released, stop - self.released)
+            self.released = stop
+
+    def __len__(self) -> int:
+        return len(self.ranges)
+
+    def __getitem__(self, index: int) -> m.Team:
+        _, start, stop = self.ranges[index]
+        return next(r.parse_team_records(self.records(start, stop)))
+
+    def __iter__(self):
+        for index in range(len(self.ranges)):
+            yield self[index]
+            self.release(self.ranges[index][2])
+
+    def find(self, name: str) -> m.Team:
+        """ return the team named name, or None if there is no such team """
+        index = self.index.get(name)
+        return None if index is None else self[index]
+
+    def parse(self) -> m.EPP:
+        """ parse every team and return the EPP data structure (same as epp_reader.parse()) """
+
+        with st.stage("parse") as counts:
+            epp = m.EPP()
+            for team in self:
+                epp.append(team)
+            r.count_students(epp, counts)
+        return epp
+
+    def close(self) -> None:
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def parse_mapped(filename: str) -> m.EPP:
+    """ parse a csv file through a MappedExport and return the EPP data structure """
+
+    with MappedExport(filename) as export:
+        return export.parse()
@@ -1,3 +1,6 @@
+import epp_stats as st
+
+
 class Evaluator(list):
     """ A student that performed an evaluation during the peer review.
     An Evaluator is a list the contains the scores that this evaluator
@@ -6,13 +9,15 @@ class Evaluator(list):
     Evaluator attributes are:
     - last_name: evaluator student's last name
     - surname:   evaluator student's surname
-    - score:     average score given to the evaluated student normalized to 100 """
+    - score:     average score given to the evaluated student normalized to 100
+    - owner:     the Evaluated this evaluator was appended to (None until then) """
     
     def __init__(self, last_name: str, surname: str):
         super().__init__()
         self.last_name = last_name
         self.surname = surname
         self.score = 0.0
+        self.owner = None
         
     def compute(self, min_scale: int, max_scale: int) -> float:
         total = 0.0
@@ -39,6 +44,8 @@ class Evaluator(list):
     def append(self, value: int):
         if type(value) is int:
             super().append(value)
+            if self.owner is not None:
+                self.owner.mark_dirty()
         else:
             raise TypeError("int expected")
     
@@ -65,7 +72,17 @@ class Evaluated(list):
                  by an administrator with a manual input. In this case,
                  the note is not the score average, but the actual note
                  entered by the administrator.
+    - override_source: for auditing, where the overridden note comes from: the line
+                 number of the csv row it was read from (the header is line 1), or None
+                 if the note was not overridden or the line is unknown (rows parsed from
+                 dictionaries)
+    - owner:     the Team this student was appended to (None until then)
+    
+    The Evaluator objects of an overridden student are never computed: the parser does
+    not build them (see epp_reader.parse_team_records()).
                  
+    Appending an Evaluator, appending a score to one of its Evaluator or calling
+    modify() marks the owning Team as dirty (see EPP.recompute()).
     compute_note() should be called after all teams have been added to EPP.
     compute_factor() should be called once the team average is known.
     compute_note() and compute_factor() are normally called by Team.compute(). """
@@ -78,6 +95,8 @@ class Evaluated(list):
         self.modified = False
         self.note = 0.0
         self.factor = 0.0
+        self.override_source = None
+        self.owner = None
         
     def compute_note(self, min_scale: int, max_scale: int) -> float:
         if self.modified:
@@ -92,9 +111,15 @@ class Evaluated(list):
     def compute_factor(self, average: float) -> None:
         self.factor = self.note / average
         
-    def modify(self, note: float) -> None:
+    def modify(self, note: float, source: int = None) -> None:
         self.note = note
         self.modified = True
+        self.override_source = source
+        self.mark_dirty()
+        
+    def mark_dirty(self) -> None:
+        if self.owner is not None:
+            self.owner.mark_dirty()
                 
     def __repr__(self) -> str:
         s = f"  Evaluated: {self.last_name}, {self.surname}, {self.email}, note={self.note:0.1f}, factor={self.factor:0.2f}, mod={self.modified}\n"
@@ -105,6 +130,10 @@ class Evaluated(list):
     def append(self, e: Evaluator):
         if type(e) is Evaluator:
             super().append(e)
+            e.owner = self
+            self.mark_dirty()
+            if self.owner is not None and self.owner.owner is not None:
+                self.owner.owner.index_evaluator(e)
         else:
             raise TypeError("Evaluator expected")
         
@@ -115,13 +144,24 @@ class Team(list):
     Team attributes are:
     - team_name: the team name
     - average:   average of all the Team evaluations
+    - dirty:     True if the team changed since its last compute()
+    - owner:     the EPP this team was appended to (None until then)
     Team.compute() should be called after all teams have been added to EPP.
-    Team.compute() is normaly called from EPP.compute(). """
+    Team.compute() is normaly called from EPP.compute() or EPP.recompute(). """
     
     def __init__(self, team_name: str):
         super().__init__()
         self.name = team_name
         self.average = 0.0
+        self.dirty = True
+        self.owner = None
+        
+    def mark_dirty(self) -> None:
+        if self.dirty:
+            return
+        self.dirty = True
+        if self.owner is not None:
+            self.owner.mark_dirty(self)
         
     def compute(self, min_scale: int, max_scale: int) -> None:
         # compute evaluated students notes
@@ -134,6 +174,8 @@ class Team(list):
         for e in self:
             e.compute_factor(self.average)
             
+        self.dirty = False
+            
     def __repr__(self) -> str:
         s = f"\nTeam: {self.name}, average score={self.average:0.2f}\n"
         for e in self:
@@ -143,6 +185,10 @@ class Team(list):
     def append(self, e: Evaluated):
         if type(e) is Evaluated:
             super().append(e)
+            e.owner = self
+            self.mark_dirty()
+            if self.owner is not None:
+                self.owner.index_evaluated(e)
         else:
             raise TypeError("Evaluated expected")
 
@@ -173,14 +219,111 @@ class EPP(list):
         2 - average
         3 - good
         4 - excellent
-    would lead to min_scale = 0 and max_scale = 4. """
+    would lead to min_scale = 0 and max_scale = 4.
+    
+    Once EPP.compute() has been called, the EPP keeps track of the teams modified
+    since then (Evaluated.modify(), a late Evaluator or score appended, ...).
+    EPP.recompute() only recomputes these dirty teams, using the last scale.
+    
+    find_team(), find_evaluated() and find_evaluations() look up a team by name, an
+    evaluated student by email and the evaluations written by an evaluator in O(1).
+    The indexes are built by the first lookup, then kept up to date by append() at
+    every level (EPP, Team and Evaluated). """
     
     def __init__(self):
         super().__init__()
+        self.min_scale = None
+        self.max_scale = None
+        self.dirty_teams = {}
+        self.indexed = False
+        self.teams_by_name = {}
+        self.evaluated_by_email = {}
+        self.evaluators_by_name = {}
             
     def compute(self, min_scale: int, max_scale: int) -> None:
+        with st.stage("compute") as counts:
+            self.min_scale = min_scale
+            self.max_scale = max_scale
+            for t in self:
+                t.compute(min_scale, max_scale)
+            self.dirty_teams.clear()
+            counts["teams"] = len(self)
+            counts["students"] = sum(len(t) for t in self)
+        
+    def recompute(self) -> list:
+        """ recompute the teams modified since the last compute() or recompute()
+        and return them """
+        if self.min_scale is None:
+            raise ValueError("compute() must be called before recompute()")
+        teams = list(self.dirty_teams.values())
+        for t in teams:
+            t.compute(self.min_scale, self.max_scale)
+        self.dirty_teams.clear()
+        return teams
+    
+    def mark_dirty(self, t: Team) -> None:
+        # teams are lists, hence not hashable: they are indexed by id
+        self.dirty_teams[id(t)] = t
+
+    def build_indexes(self) -> None:
+        """ build the lookup indexes from the current content of the EPP """
+        self.teams_by_name = {}
+        self.evaluated_by_email = {}
+        self.evaluators_by_name = {}
+        self.indexed = True
         for t in self:
-            t.compute(min_scale, max_scale)
+            self.index_team(t)
+    
+    def index_team(self, t: Team) -> None:
+        # a name or an email may appear more than once (see epp_reader.parse()):
+        # the first occurrence is kept
+        if not self.indexed:
+            return
+        self.teams_by_name.setdefault(t.name, t)
+        for e in t:
+            self.index_evaluated(e)
+    
+    def index_evaluated(self, e: Evaluated) -> None:
+        if not self.indexed:
+            return
+        self.evaluated_by_email.setdefault(e.email, e)
+        for evaluator in e:
+            self.index_evaluator(evaluator)
+    
+    def index_evaluator(self, evaluator: Evaluator) -> None:
+        if not self.indexed:
+            return
+        self.evaluators_by_name.setdefault((evaluator.last_name, evaluator.surname), []).append(evaluator)
+    
+    def find_team(self, name: str) -> Team:
+        """ return the team named name, or None """
+        if not self.indexed:
+            self.build_indexes()
+        return self.teams_by_name.get(name)
+    
+    def find_evaluated(self, email: str) -> Evaluated:
+        """ return the evaluated student whose email is email, or None """
+        if not self.indexed:
+            self.build_indexes()
+        return self.evaluated_by_email.get(email)
+    
+    def find_evaluations(self, last_name: str, surname: str) -> list:
+        """ return the evaluations written by an evaluator (who evaluated whom): the list
+        of its Evaluator objects. The owner of each one is the evaluated student. """
+        if not self.indexed:
+            self.build_indexes()
+        return list(self.evaluators_by_name.get((last_name, surname), []))
+    
+    def __setstate__(self, state: dict) -> None:
+        # ids are not preserved by pickle (see epp_cache): re-index the dirty teams
+        self.__dict__.update(state)
+        self.dirty_teams = {id(t): t for t in state["dirty_teams"].values()}
+        # EPP structures cached before the lookup indexes were introduced
+        if "indexed" not in state:
+            self.indexed = False
+            self.teams_by_name = {}
+            self.evaluated_by_email = {}
+            self.evaluators_by_name = {}
 
     def __repr__(self) -> str:
         s = ""
@@ -191,5 +334,9 @@ class EPP(list):
     def append(self, t: Team):
         if type(t) is Team:
             super().append(t)
+            t.owner = self
+            if t.dirty:
+                self.mark_dirty(t)
+            self.index_team(t)
         else:
             raise TypeError("Team expected")
@@ -1,5 +1,9 @@
 import csv
+import codecs
+import locale
+from operator import itemgetter
 import epp_model as m
+import epp_stats as st
 
 """ Static functions to read and parse the CSV file produced by Workshop ETS (sans multiligne)
     It is assumed that the file read in the context of the peer review is produced by the
@@ -19,6 +23,15 @@ import epp_model as m
     produce an temporary file. clean_csv() was added because some non-printable
     characters are sometimes present in the original file outputed by "Export des evaluations".
     
+    Alternatively, stream_csv() cleans the file on the fly and yields rows one at a time,
+    without any temporary file. Combined with parse_teams(), which yields each Team as soon
+    as it is complete, memory usage is bounded by the size of a single team.
+    
+    stream_records() is the fastest path: it yields plain tuples holding only the columns
+    used by the parser (see COLUMNS) and the csv line number, to be parsed by
+    parse_records() or parse_indexed_records(). parse(), parse_teams() and parse_indexed()
+    accept dictionaries and convert them to records.
+    
     For reference, here is an excerpt of the CSV file expected.
     
 Groupe;Nom_évalué;Prenom_évalué;Courriel_évalué;Bareme;Note_aspect;Note_calc;Note_modif;Note;MNG;Facteur;Commentaires;Nom_évaluateur;Prenom_évaluateur;Commentaires_generaux
@@ -58,93 +71,357 @@ EQUIPE1_ELE795;etudiant13;etudiant13;etudiant13@etsmtl.ca;Présence;4;75;0;75;46
 EQUIPE1_ELE795;etudiant13;etudiant13;etudiant13@etsmtl.ca;"Quantité de travail";4;75;0;75;46,25;1,621622;"Étudiant12 évalue Étudiant13";etudiant12;etudiant12;"Commentaire general&nbsp;Étudiant12 évalue Étudiant13"
 ...
 """
+
+# version of the parser, used by epp_cache to invalidate cached EPP structures.
+# Increment it when a change to the parser or the model alters the EPP produced.
+PARSER_VERSION = 4
+
     
 def read_csv(filename: str) -> list:
     """ read a csv file and return a list of dictionaries """
     
-    in_file = open(filename)
-    csv_reader = csv.DictReader(in_file, delimiter=";")
-    
-    rows = []
-    for row in csv_reader:
-        rows.append(row)
-    
-    in_file.close()
+    with st.stage("read") as counts:
+        in_file = open(filename)
+        csv_reader = csv.DictReader(in_file, delimiter=";")
+        
+        rows = []
+        for row in csv_reader:
+            rows.append(row)
+        
+        in_file.close()
+        counts["rows"] = len(rows)
     return rows
 
 
-def clean_csv(in_file: str, out_file: str) -> None:
-    """ remove non-printable characters from in_file and write result to out_file """
+class NonPrintableTable(dict):
+    """ translation table for str.translate() that deletes non-printable characters.
+    Entries are computed on first use and then cached, so that each distinct code point
+    is tested with isprintable() only once. """
+            
+    def __missing__(self, code: int):
+        value = code if chr(code).isprintable() else None
+        self[code] = value
+        return value
+
+
+# table shared by clean_lines() and sanitize_csv()
+TABLE = NonPrintableTable()
+
+
+def clean_csv(in_file: str, out_file: str) -> dict:
+    """ remove non-printable characters from in_file and write result to out_file.
+    Returns {line number: number of characters stripped} (see sanitize_csv()). """
     
-    with open(in_file, "rt") as f:
-        in_lines = f.readlines()
+    return sanitize_csv(in_file, out_file)
+
+
+def sanitize_csv(in_file: str, out_file: str, chunk_size: int = 1 << 20) -> dict:
+    """ remove non-printable characters from in_file and write result to out_file.
+    The output is identical to the original line by line implementation of clean_csv()
+    (''.join(c for c in line if c.isprintable()) + '\\n'), but the file is read in binary
+    chunks of chunk_size bytes, decoded incrementally (a multi-byte character may be split
+    between two chunks), and only the lines that contain non-printable characters are
+    filtered, with a cached str.translate() table. The BOM at the start of the
+    export is a non-printable character and is removed like the others.
+    Returns a dictionary {line number: number of characters stripped} (lines start at 1). """
     
-    out_lines = []
-    for in_line in in_lines:
-        # from https://stackoverflow.com/questions/92438/stripping-non-printable-characters-from-a-string-in-python
-        out_line = ''.join(c for c in in_line if c.isprintable())
-        out_lines.append(out_line + '\n')
+    with st.stage("clean") as counts:
+        # same encoding as open() in text mode
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))()
+        stripped = {}
+        line = 1
+        pending_cr = False
+        last = None
         
-    with open(out_file, "wt") as f:
-        f.writelines(out_lines)
+        with open(in_file, "rb") as fin, open(out_file, "wt") as fout:
+            while True:
+                data = fin.read(chunk_size)
+                final = len(data) == 0
+                text = decoder.decode(data, final)
+                
+                # universal newlines, as in text mode: CR LF and CR become LF.
+                # A CR at the end of a chunk may be followed by LF in the next one.
+                if pending_cr:
+                    text = '\r' + text
+                    pending_cr = False
+                if not final and text.endswith('\r'):
+                    text = text[:-1]
+                    pending_cr = True
+                if '\r' in text:
+                    text = text.replace('\r\n', '\n').replace('\r', '\n')
+                    
+                if len(text) > 0:
+                    lines = text.split('\n')
+                    for index, segment in enumerate(lines):
+                        # isprintable() is a fast C test: only lines that actually contain
+                        # non-printable characters go through str.translate()
+                        if not segment.isprintable():
+                            lines[index] = segment.translate(TABLE)
+                            stripped[line + index] = stripped.get(line + index, 0) + len(segment) - len(lines[index])
+                    line += len(lines) - 1
+                    last = text[-1]
+                    fout.write('\n'.join(lines))
+                    
+                if final:
+                    break
+                    
+            # like clean_csv(), terminate the last line
+            if last is not None and last != '\n':
+                fout.write('\n')
+                line += 1
+                
+        counts["lines"] = line - 1
+        counts["stripped"] = sum(stripped.values())
+    return stripped
+
+
+def clean_lines(in_file, stripped: dict = None):
+    """ generator that removes non-printable characters from each line of in_file
+    (an opened text file) and yields the cleaned lines. Equivalent to clean_csv()
+    without the temporary file. If stripped is given, the number of characters removed
+    is stored in it by line number, as returned by sanitize_csv(). """
     
+    for line, in_line in enumerate(in_file, 1):
+        if in_line.endswith('\n'):
+            in_line = in_line[:-1]
+        if in_line.isprintable():
+            yield in_line + '\n'
+        else:
+            out_line = in_line.translate(TABLE)
+            if stripped is not None:
+                stripped[line] = len(in_line) - len(out_line)
+            yield out_line + '\n'
 
-def get_empty_dict(row: dict) -> dict:
-    """ returns an empty dictionary with same key entries as row """
+
+def stream_csv(filename: str):
+    """ generator that reads a csv file, removes non-printable characters on the fly
+    and yields one dictionary per row """
     
-    empty = {}
-    keys = row.keys();
-    for key in keys:
-        empty[key] = ""
+    with open(filename, "rt") as f:
+        yield from stream_rows(f)
+
+
+def stream_rows(in_file):
+    """ generator that yields one dictionary per row of in_file (an opened text file
+    or any iterable of lines, such as io.StringIO), removing non-printable characters.
+    As in read_records(), a row repeating the header is skipped. """
     
-    return empty
-     
-        
-def parse(rows: list) -> m.EPP:
+    csv_reader = csv.DictReader(clean_lines(in_file), delimiter=";")
+    for row in csv_reader:
+        if list(row.values()) != csv_reader.fieldnames:
+            yield row
+
+
+# columns used by the parser, in the order of the fields of a record
+COLUMNS = ("Groupe", "Nom_évalué", "Prenom_évalué", "Courriel_évalué",
+           "Nom_évaluateur", "Prenom_évaluateur", "Note_modif", "Note_aspect")
+
+
+def stream_records(filename: str, stripped: dict = None):
+    """ generator that reads a csv file, removes non-printable characters on the fly
+    and yields one record per row (see read_records()) """
+    
+    with open(filename, "rt") as f:
+        yield from read_records(f, stripped = stripped)
+
+
+def read_records(in_file, fieldnames: list = None, stripped: dict = None, first_line: int = 1):
+    """ generator that yields one record per row of in_file (an opened text file or any
+    iterable of lines), removing non-printable characters.
+    A record is a tuple of the fields of COLUMNS only, followed by the line number of the
+    row in the csv file (first_line being the number of the first line of in_file, as
+    counted by clean_lines()). Unlike stream_rows(), no dictionary
+    is built: the positions of the columns are resolved once from the header (the first
+    line, unless fieldnames is given) and the fields are picked with an itemgetter.
+    Parsing records is several times faster than parsing dictionaries.
+    The characters removed are counted in stripped, if given (see clean_lines()).
+    A row equal to the header is skipped: concatenated exports (cat a.csv b.csv) repeat it. """
+    
+    csv_reader = csv.reader(clean_lines(in_file, stripped), delimiter=";")
+    if fieldnames is None:
+        fieldnames = next(csv_reader, None)
+        if fieldnames is None:
+            return
+    # like csv.DictReader, the last of duplicate column names wins
+    positions = {name: index for index, name in enumerate(fieldnames)}
+    # the line number is appended to the row: picked last
+    getter = itemgetter(*[positions[name] for name in COLUMNS], -1)
+    offset = first_line - 1
+    for row in csv_reader:
+        # csv.DictReader skips blank lines
+        if row and row != fieldnames:
+            row.append(csv_reader.line_num + offset)
+            yield getter(row)
+
+
+def records(rows):
+    """ generator that converts rows (dictionaries, as yielded by stream_csv()) to records.
+    The line numbers of the rows are not known: they are None. """
+    
+    getter = itemgetter(*COLUMNS)
+    return (getter(row) + (None,) for row in rows)
+
+
+def parse(rows) -> m.EPP:
     """ parse rows and create an EPP data structure.
-    rows is an array of dictionnary. Each individual row is a line
-    from the CSV file in the form of a dictionnary. """
+    rows is an iterable of dictionnary (a list or a generator such as stream_csv()).
+    Each individual row is a line from the CSV file in the form of a dictionnary. """
+    
+    return parse_records(records(rows))
+
+
+def parse_records(rows) -> m.EPP:
+    """ same as parse(), but rows is an iterable of records (see read_records()) """
+    
+    with st.stage("parse") as counts:
+        if st.active():
+            rows = st.counted(rows, counts)
+        epp = m.EPP()
+        for team in parse_team_records(rows):
+            epp.append(team)
+        count_students(epp, counts)
+    return epp
+
+
+def count_students(epp: m.EPP, counts: dict) -> None:
+    """ store the number of teams and evaluated students of epp in counts (see epp_stats) """
+    counts["teams"] = len(epp)
+    counts["students"] = sum(len(t) for t in epp)
+
+
+def parse_teams(rows):
+    """ generator that parses rows and yields each Team once all its rows have been read.
+    rows is an iterable of dictionnary and is consumed only once, so that only the
+    team being built is held in memory. """
     
-    last = get_empty_dict(rows[0])
-    epp = m.EPP()
+    return parse_team_records(records(rows))
+
+
+# Evaluator.append() without the type check and the dirty propagation, for the parser only:
+# the scores are ints and the teams being parsed are new, hence already dirty
+add_score = list.append
+
+
+def parse_team_records(rows):
+    """ same as parse_teams(), but rows is an iterable of records (see read_records()) """
     
-    for row in rows:
+    team = None
+    last_team = None
+    last_evaluated = None
+    last_evaluator = None
+    last_modif = None
+    
+    for group, last_name, surname, email, evaluator_last_name, evaluator_surname, note_modif, note_aspect, line in rows:
         team_added = False
         evaluated_added = False
         
         # detect team changes in csv file
-        if last["Groupe"] != row["Groupe"]:
-            last["Groupe"] = row["Groupe"]
-            team = m.Team(row["Groupe"])
-            epp.append(team)
+        if last_team != group:
+            last_team = group
+            if team is not None:
+                yield team
+            team = m.Team(group)
             team_added = True
             
         # detect evaluated student change in csv file
-        if team_added \
-        or last["Nom_évalué"] != row["Nom_évalué"] \
-        or last["Prenom_évalué"] != row["Prenom_évalué"]:
-            last["Nom_évalué"] = row["Nom_évalué"]
-            last["Prenom_évalué"] = row["Prenom_évalué"]
-            evaluated = m.Evaluated(row["Nom_évalué"], row["Prenom_évalué"], row["Courriel_évalué"])
+        if team_added or last_evaluated != (last_name, surname):
+            last_evaluated = (last_name, surname)
+            evaluated = m.Evaluated(last_name, surname, email)
             team.append(evaluated)
             evaluated_added = True
             
+        # Note_modif is the same on most rows: convert it only when it changes
+        if note_modif != last_modif:
+            last_modif = note_modif
+            modified_note = float(note_modif)
+            
+        # use the overridden note if it is not 0 (see override())
+        if modified_note > 0.0:
+            override(evaluated, modified_note, line)
+            continue
+        if evaluated.modified:
+            continue
+            
         # detect an evaluator student change is csv file
-        if team_added \
-        or evaluated_added \
-        or last["Nom_évaluateur"] != row["Nom_évaluateur"] \
-        or last["Prenom_évaluateur"] != row["Prenom_évaluateur"]:
-            last["Nom_évaluateur"] = row["Nom_évaluateur"]
-            last["Prenom_évaluateur"] = row["Prenom_évaluateur"]
-            evaluator = m.Evaluator(row["Nom_évaluateur"], row["Prenom_évaluateur"])
+        if team_added or evaluated_added or last_evaluator != (evaluator_last_name, evaluator_surname):
+            last_evaluator = (evaluator_last_name, evaluator_surname)
+            evaluator = m.Evaluator(evaluator_last_name, evaluator_surname)
             evaluated.append(evaluator)
             
-        # use the overridden note as the aspect score if the overridden note is not 0
-        # otherwise use aspect score as is.
-        modified_note = float(row["Note_modif"])
-        if modified_note > 0.0:
-            evaluated.modify(modified_note)
-        else:
-            evaluator.append(int(row["Note_aspect"]))
+        add_score(evaluator, int(note_aspect))
+            
+    if team is not None:
+        yield team
+
+
+def override(evaluated: m.Evaluated, note: float, line: int) -> None:
+    """ apply the overridden note of a row to an evaluated student.
+    The note is set by the first row carrying it. As before, if the export gives another
+    value on a later row of the same student, the last value wins. The csv line number of
+    the row the note comes from is kept in evaluated.override_source. Once a student is
+    overridden, its aspect scores are never used: the parsers skip the Evaluator objects
+    of its remaining rows. """
+    
+    if not evaluated.modified or evaluated.note != note:
+        evaluated.modify(note, line)
+
+
+def parse_indexed(rows) -> m.EPP:
+    """ parse rows and create an EPP data structure, whatever the order of the rows.
+    Unlike parse(), which detects a new team, evaluated or evaluator student by comparing
+    a row with the previous one, parse_indexed() looks up entities in dictionaries keyed on
+    (Groupe, Nom/Prenom évalué, Nom/Prenom évaluateur). Rows may therefore be re-sorted,
+    interleaved or come from several concatenated exports.
+    Teams, evaluated and evaluator students appear in the order of their first row. """
+    
+    return parse_indexed_records(records(rows))
+
+
+def parse_indexed_records(rows) -> m.EPP:
+    """ same as parse_indexed(), but rows is an iterable of records (see read_records()) """
+    
+    with st.stage("parse") as counts:
+        if st.active():
+            rows = st.counted(rows, counts)
+        epp = m.EPP()
+        teams = {}
+        evaluateds = {}
+        evaluators = {}
+        last_modif = None
+    
+        for group, last_name, surname, email, evaluator_last_name, evaluator_surname, note_modif, note_aspect, line in rows:
+            team = teams.get(group)
+            if team is None:
+                team = m.Team(group)
+                teams[group] = team
+                epp.append(team)
             
-    return epp
\ No newline at end of file
+            evaluated_key = (group, last_name, surname)
+            evaluated = evaluateds.get(evaluated_key)
+            if evaluated is None:
+                evaluated = m.Evaluated(last_name, surname, email)
+                evaluateds[evaluated_key] = evaluated
+                team.append(evaluated)
+            
+            # use the overridden note if it is not 0 (see override())
+            if note_modif != last_modif:
+                last_modif = note_modif
+                modified_note = float(note_modif)
+            if modified_note > 0.0:
+                override(evaluated, modified_note, line)
+                continue
+            if evaluated.modified:
+                continue
+            
+            evaluator_key = evaluated_key + (evaluator_last_name, evaluator_surname)
+            evaluator = evaluators.get(evaluator_key)
+            if evaluator is None:
+                evaluator = m.Evaluator(evaluator_last_name, evaluator_surname)
+                evaluators[evaluator_key] = evaluator
+                evaluated.append(evaluator)
+            
+            add_score(evaluator, int(note_aspect))
+                
+        count_students(epp, counts)
+    
+    return epp
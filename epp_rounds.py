@@ -0,0 +1,112 @@
+import os
+import epp_model as m
+import epp_reader as r
+import epp_stats as st
+
+""" Longitudinal aggregation of several peer review rounds.
+    A course may run several peer reviews per term, each exported as a separate csv file.
+    read_rounds() parses and computes every export (one round per file, in a process pool),
+    then build_table() matches the evaluated students across rounds by their email
+    (Courriel_évalué) and produces one row per student with, for each round:
+        - Groupe_n:  the student's team in round n (empty if absent from the round)
+        - Facteur_n: the factor of round n, computed by Team.compute() as by EPP.py
+        - Cumul_n:   the weighted average of the factors of rounds 1 to n in which the
+                     student appears (the cumulative factor after round n)
+    and the final cumulative factor. Each round has a weight (1 by default).
+
+    Exports go through the cache (see epp_cache): a file that has not changed since the
+    last run is neither read nor parsed again.
+
+        epps = epp_rounds.read_rounds(["round1.csv", "round2.csv"], 1, 5)
+        header, rows = epp_rounds.build_table(epps, [1.0, 2.0])
+        epp_writer.write_table("cumul.xlsx", header, rows) """
+
+
+def read_round(filename: str, min_scale: int, max_scale: int, unsorted: bool = False, use_cache: bool = True) -> m.EPP:
+    """ read, parse and compute a single export. Used as the worker of read_rounds(). """
+
+    parse = r.parse_indexed_records if unsorted else r.parse_records
+    read = lambda f: parse(r.stream_records(f))
+    if use_cache:
+        import epp_cache as c
+        epp = c.cached_parse(filename, read, "unsorted" if unsorted else "sorted")
+    else:
+        epp = read(filename)
+    epp.compute(min_scale, max_scale)
+    return epp
+
+
+def read_rounds(filenames: list, min_scale: int, max_scale: int, unsorted: bool = False, use_cache: bool = True, jobs: int = None) -> list:
+    """ return the computed EPP of each export, in the order of filenames.
+    Files are processed in parallel by jobs processes (default: number of processors). """
+
+    if jobs == 1 or len(filenames) == 1:
+        return [read_round(f, min_scale, max_scale, unsorted, use_cache) for f in filenames]
+
+    import concurrent.futures as cf
+
+    with cf.ProcessPoolExecutor(max_workers = jobs) as pool:
+        futures = [pool.submit(read_round, f, min_scale, max_scale, unsorted, use_cache) for f in filenames]
+        return [future.result() for future in futures]
+
+
+def build_table(epps: list, weights: list = None) -> tuple:
+    """ match the students of every round by email and return (header, rows).
+    weights gives the weight of each round in the cumulative factor (default: 1 each).
+    Students appear in the order of their first round. In a round, a student appearing
+    in several teams is taken from the first one (see EPP.find_evaluated()). """
+
+    if weights is None:
+        weights = [1.0] * len(epps)
+    if len(weights) != len(epps):
+        raise ValueError("one weight per round expected")
+
+    with st.stage("aggregate") as counts:
+        # first occurrence of each student, across rounds
+        students = {}
+        for epp in epps:
+            for t in epp:
+                for e in t:
+                    students.setdefault(e.email, e)
+
+        header = ["Courriel", "Nom", "Prenom"]
+        for n in range(1, len(epps) + 1):
+            header += [f"Groupe_{n}", f"Facteur_{n}", f"Cumul_{n}"]
+        header.append("Facteur_cumulatif")
+
+        rows = []
+        for email, first in students.items():
+            row = [email, first.last_name, first.surname]
+            total = 0.0
+            total_weight = 0.0
+            cumulative = None
+            for epp, weight in zip(epps, weights):
+                e = epp.find_evaluated(email)
+                if e is None:
+                    row += ["", None, cumulative]
+                    continue
+                total += weight * e.factor
+                total_weight += weight
+                cumulative = total / total_weight if total_weight > 0 else None
+                row += [e.owner.name, e.factor, cumulative]
+            row.append(cumulative)
+            rows.append(row)
+
+        counts["students"] = len(rows)
+    return (header, rows)
+
+
+def aggregate(filenames: list, output_filename: str, min_scale: int, max_scale: int, weights: list = None,
+              format: str = "xlsx", unsorted: bool = False, use_cache: bool = True, jobs: int = None) -> None:
+    """ read every export, match the students and write the combined table """
+
+    import epp_writer as w
+
+    epps = read_rounds(filenames, min_scale, max_scale, unsorted, use_cache, jobs)
+    header, rows = build_table(epps, weights)
+    w.write_table(output_filename, header, rows, format, "Cumul des EPP")
+
+
+def default_output(filenames: list, format: str) -> str:
+    """ return the default output file name: the first export with a _cumul suffix """
+    return os.path.splitext(filenames[0])[0] + "_cumul." + format
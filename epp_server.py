@@ -0,0 +1,220 @@
+import io
+import json
+import asyncio
+import argparse as ap
+import urllib.parse
+import concurrent.futures as cf
+import epp_model as m
+import epp_reader as r
+import epp_writer as w
+
+""" Local HTTP service exposing parse, compute and write.
+    A long-running asyncio server avoids paying the Python and openpyxl import cost for
+    every course. CPU-bound work (parsing, computing and writing) runs in a process pool,
+    so that concurrent requests do not block each other nor the event loop. The workers
+    are not forked from the server (see Server.__init__()). Check with:
+         $ python3 -m benchmarks.server
+
+    Endpoints (the request body is the csv export, as produced by Workshop ÉTS):
+        POST /xlsx?min=1&max=5    returns the xlsx file (same content as EPP.py)
+        POST /json?min=1&max=5    returns a JSON summary of notes, averages and factors
+        GET  /health              returns 'ok'
+    Optional query parameters: unsorted=1 (see epp_reader.parse_indexed()) and
+    course=ELE400 or course=ELE795 (sets min and max as in EPP.py).
+
+    Typical invocation:
+         $ python3 epp_server.py --port 8400
+         $ curl --data-binary @evaluations.csv -o evaluations.xlsx "http://127.0.0.1:8400/xlsx?course=ELE400" """
+
+XLSX_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MAX_BODY = 512 * 1024 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    """ An error reported to the client with an HTTP status """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def process(data: bytes, min_scale: int, max_scale: int, unsorted: bool, output: str) -> bytes:
+    """ parse a csv export (raw bytes), compute it and return the xlsx file or the JSON
+    summary as bytes. Runs in a worker process. """
+
+    # utf-8-sig would drop the BOM, but it is removed anyway as a non-printable character
+    text = io.StringIO(data.decode("utf-8"), newline = None)
+    rows = r.read_records(text)
+    epp = r.parse_indexed_records(rows) if unsorted else r.parse_records(rows)
+    epp.compute(min_scale, max_scale)
+
+    if output == "xlsx":
+        out = io.BytesIO()
+        w.write_xlsx(out, epp)
+        return out.getvalue()
+    return json.dumps(summary(epp, min_scale, max_scale), ensure_ascii = False).encode("utf-8")
+
+
+def summary(epp: m.EPP, min_scale: int, max_scale: int) -> dict:
+    """ return the computed values of epp as a dictionary that can be serialized to JSON """
+
+    teams = []
+    for team in epp:
+        students = []
+        for e in team:
+            students.append({"last_name": e.last_name, "surname": e.surname, "email": e.email,
+                             "note": e.note, "factor": e.factor, "modified": e.modified,
+                             "override_line": e.override_source})
+        teams.append({"name": team.name, "average": team.average, "students": students})
+    return {"min": min_scale, "max": max_scale, "teams": teams}
+
+
+def get_scale(query: dict) -> tuple:
+    """ return (min, max) from the query parameters, following the rules of EPP.py """
+
+    course = query.get("course", [""])[0].upper()
+    if course == "ELE400":
+        return (1, 5)
+    if course == "ELE795":
+        return (0, 3)
+    try:
+        min_scale = int(query.get("min", ["1"])[0])
+        max_scale = int(query.get("max", ["5"])[0])
+    except ValueError:
+        raise RequestError(400, "min et max doivent être des entiers")
+    if min_scale not in (0, 1) or max_scale not in (2, 3, 4, 5):
+        raise RequestError(400, "min doit être 0 ou 1 et max entre 2 et 5")
+    return (min_scale, max_scale)
+
+
+class Server:
+    """ asyncio HTTP server. The pool is shared by all requests.
+    Server attributes are:
+    - pool:   executor running process()
+    - server: the asyncio.Server, once start() has been called """
+
+    def __init__(self, jobs: int = None):
+        # forked workers would inherit the sockets of the clients connected at the time of
+        # the fork and keep their connections open: workers are started by a fork server
+        # (or spawned), from a process that has no client socket
+        import multiprocessing as mp
+        method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        self.pool = cf.ProcessPoolExecutor(max_workers = jobs, mp_context = mp.get_context(method))
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8400) -> int:
+        """ start the workers, then start listening and return the actual port
+        (use port 0 to pick a free one) """
+
+        # the first request does not wait for the workers to start
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.pool, int)
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+        self.pool.shutdown()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                status, content_type, body = await self.respond(reader)
+            except RequestError as e:
+                status, content_type, body = e.status, "text/plain; charset=utf-8", str(e).encode("utf-8")
+            except Exception as e:
+                status, content_type, body = 500, "text/plain; charset=utf-8", f"{type(e).__name__}: {e}".encode("utf-8")
+
+            header = f"HTTP/1.1 {status} {REASONS[status]}\r\n" \
+                     f"Content-Type: {content_type}\r\n" \
+                     f"Content-Length: {len(body)}\r\n" \
+                     "Connection: close\r\n\r\n"
+            writer.write(header.encode("ascii") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, reader: asyncio.StreamReader) -> tuple:
+        """ read a request and return (status, content type, body) """
+
+        try:
+            request_line = (await reader.readline()).decode("ascii").split()
+            method, target = request_line[0], request_line[1]
+        except (UnicodeDecodeError, IndexError):
+            raise RequestError(400, "requête invalide")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+
+        if url.path == "/health":
+            return (200, "text/plain; charset=utf-8", b"ok")
+        if url.path not in ("/xlsx", "/json"):
+            raise RequestError(404, "chemin inconnu: " + url.path)
+        if method != "POST":
+            raise RequestError(405, "utilisez POST")
+
+        # without Content-Length, the end of the export cannot be told from a lost connection
+        if "content-length" not in headers:
+            raise RequestError(411, "Content-Length manquant")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise RequestError(400, "Content-Length invalide")
+        if length < 0:
+            raise RequestError(400, "Content-Length invalide")
+        if length > MAX_BODY:
+            raise RequestError(413, "fichier trop volumineux")
+        try:
+            data = await reader.readexactly(length)
+        except asyncio.IncompleteReadError as e:
+            raise RequestError(400, f"fichier csv incomplet ({len(e.partial)} octets reçus sur {length})")
+
+        min_scale, max_scale = get_scale(query)
+        unsorted = query.get("unsorted", ["0"])[0] not in ("0", "")
+        output = url.path[1:]
+
+        loop = asyncio.get_running_loop()
+        try:
+            body = await loop.run_in_executor(self.pool, process, data, min_scale, max_scale, unsorted, output)
+        except (ValueError, KeyError, IndexError, ZeroDivisionError) as e:
+            raise RequestError(400, f"fichier csv invalide ({type(e).__name__}: {e})")
+
+        content_type = XLSX_TYPE if output == "xlsx" else "application/json; charset=utf-8"
+        return (200, content_type, body)
+
+
+async def serve(host: str, port: int, jobs: int) -> None:
+    server = Server(jobs)
+    port = await server.start(host, port)
+    print(f"Service EPP à l'écoute sur http://{host}:{port}")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description = "Service HTTP local produisant les fichiers xlsx ou json à partir des exports csv")
+    parser.add_argument('--host', default = "127.0.0.1", help = 'adresse d\'écoute (défaut: 127.0.0.1)')
+    parser.add_argument('--port', type = int, default = 8400, help = 'port d\'écoute (défaut: 8400)')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = 'nombre de processus (défaut: nombre de processeurs)')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.jobs))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,108 @@
+import json
+import time
+from contextlib import contextmanager
+
+""" Per-stage instrumentation of the EPP pipeline.
+    The reader, model and writer wrap each stage (clean, read, parse, compute, write)
+    in stage(). When at least one hook is registered with add_hook(), every completed stage
+    produces a record (a dictionary) that is passed to each hook:
+        - stage:      stage name
+        - wall:       wall time in seconds
+        - cpu:        process CPU time in seconds
+        - peak_bytes: peak memory allocated during the stage (None unless tracemalloc is tracing)
+        - rows, lines, teams, students: counts relevant to the stage
+    Without hooks, stage() costs almost nothing. Collector is a hook that keeps the records
+    and formats them. Typical library usage:
+
+        collector = epp_stats.Collector()
+        epp_stats.add_hook(collector)
+        epp = epp_reader.parse(epp_reader.stream_csv(filename))
+        epp.compute(1, 5)
+        print(collector.report())
+
+    Note that when parse() is fed by stream_csv(), the csv file is cleaned and read while it
+    is parsed: the parse stage then includes the clean and read times.
+    Tracing memory slows down the stages several times: measure the times and the peak
+    memory in separate runs (as benchmarks/run.py does, and EPP.py --profile-memory). """
+
+_hooks = []
+
+
+def add_hook(hook) -> None:
+    """ register a callable receiving a record for every completed stage """
+    _hooks.append(hook)
+
+
+def remove_hook(hook) -> None:
+    _hooks.remove(hook)
+
+
+def active() -> bool:
+    """ True if at least one hook is registered """
+    return len(_hooks) > 0
+
+
+@contextmanager
+def stage(name: str):
+    """ measure the enclosed block and report it to the hooks.
+    Yields a dictionary in which the block may store counts (rows, teams, ...). """
+
+    counts = {}
+    if not _hooks:
+        yield counts
+        return
+
+    import tracemalloc
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+
+    yield counts
+
+    record = {
+        "stage": name,
+        "wall": time.perf_counter() - wall,
+        "cpu": time.process_time() - cpu,
+        "peak_bytes": tracemalloc.get_traced_memory()[1] if tracing else None}
+    record.update(counts)
+    for hook in list(_hooks):
+        hook(record)
+
+
+def counted(iterable, counts: dict, key: str = "rows"):
+    """ generator that yields the items of iterable and counts them in counts[key] """
+
+    counts[key] = 0
+    for item in iterable:
+        counts[key] += 1
+        yield item
+
+
+class Collector:
+    """ A hook that keeps every stage record.
+    Collector attributes are:
+    - records: list of the records received, in order of completion """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record: dict) -> None:
+        self.records.append(record)
+
+    def report(self) -> str:
+        """ return the records formatted as a table """
+
+        s = f"{'Étape':<8} {'Mur (s)':>10} {'CPU (s)':>10} {'Mémoire (Mo)':>13} {'Lignes':>10} {'Équipes':>8} {'Étudiants':>10}\n"
+        for record in self.records:
+            peak = record["peak_bytes"]
+            peak = "-" if peak is None else f"{peak / 1e6:0.1f}"
+            rows = record.get("rows", record.get("lines", "-"))
+            s += f"{record['stage']:<8} {record['wall']:>10.3f} {record['cpu']:>10.3f} {peak:>13}" \
+                 f" {rows:>10} {record.get('teams', '-'):>8} {record.get('students', '-'):>10}\n"
+        return s
+
+    def write_json(self, filename: str) -> None:
+        with open(filename, "wt") as f:
+            json.dump(self.records, f, indent = 2)
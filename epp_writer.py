@@ -1,50 +1,370 @@
-import openpyxl as xl
+import os
+import abc
+import csv
+import json
 import epp_model as m
+import epp_stats as st
+
+""" Static function to write and Excel containing the resutls of a peer evaluation (epp)
+    Results can also be written in other formats. Each format is a Writer subclass
+    registered in WRITERS:
+        - xlsx:        XlsxWriter, the original Excel output (in-memory openpyxl workbook)
+        - xlsx-stream: XlsxStreamingWriter, same workbook in openpyxl write-only mode
+        - csv:         CsvWriter, semicolon separated, as the Workshop ÉTS exports
+        - json:        JsonWriter, a list of objects
+        - jsonl:       JsonLinesWriter, one object per line (JSON Lines)
+        - parquet:     ParquetWriter, columnar file for bulk loading (requires pyarrow)
+    Every writer produces the columns of build_header() and build_rows(), and receives the
+    teams one at a time: except for xlsx, memory usage does not grow with the cohort size.
+    Note_equipe (entered by the teacher) and Note_etudiant (its formula) only make sense in
+    a spreadsheet: the other formats leave them null.
+    json and jsonl add SOURCE_COLUMN: the csv line the overridden note was read from
+    (Evaluated.override_source), for auditing.
+    write_teams() accepts any iterable of computed teams (ex. teams computed as they are
+    yielded by epp_reader.parse_teams()).
+    openpyxl and pyarrow are imported by their writer only, so that the other formats
+    can be used without loading them. """
+
+
+class Writer(abc.ABC):
+    """ Base class of the output formats. A writer is used as a context manager:
+        with CsvWriter(filename) as writer:
+            for team in epp:
+                writer.write_team(team)
+    Subclasses implement write_rows() and, if needed, __init__(), close() and abort().
+    close() completes the file; after an error, abort() releases resources and deletes
+    the partial file (see remove()), so that no truncated output is left behind.
+    Writer attributes are:
+    - filename:    output file name
+    - row_counter: spreadsheet row of the next student (the header is row 1)
+    Class attribute spreadsheet is True for the formats that receive the Note_etudiant
+    formula (see build_rows()). """
+
+    spreadsheet = False
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.row_counter = 2
+
+    def write_team(self, team: m.Team) -> None:
+        self.write_rows(team, build_rows(team, self.row_counter, self.spreadsheet))
+        self.row_counter += len(team)
+
+    @abc.abstractmethod
+    def write_rows(self, team: m.Team, rows: list) -> None:
+        """ write the rows of team (see build_rows()) """
+
+    def close(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        pass
+
+    def remove(self) -> None:
+        """ delete the output file, if it was created """
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class XlsxWriter(Writer):
+    """ Excel workbook built in memory, then styled and saved by close() """
+
+    spreadsheet = True
+
+    def __init__(self, filename: str):
+        import openpyxl as xl
+
+        super().__init__(filename)
+        self.wb = xl.Workbook()
+        self.ws = self.wb.active
+        self.ws.title = "Sommaire de l'EPP"
+
+        # write header
+        self.ws.append(build_header())
+
+    def write_rows(self, team: m.Team, rows: list) -> None:
+        for row in rows:
+            self.ws.append(row)
+        self.ws.merge_cells(start_row = self.row_counter, start_column = 8, end_row = self.row_counter + len(team) - 1, end_column = 8)
+
+    def close(self) -> None:
+        # set style
+        for i in range(2, self.row_counter+1):
+            c = self.ws.cell(i, 5)
+            c.number_format = '0.00'
+            c = self.ws.cell(i, 6)
+            c.number_format = '0.00'
+            c = self.ws.cell(i, 7)
+            c.number_format = '0.00'
+            c = self.ws.cell(i, 9)
+            c.number_format = '0.00'
+
+        # save to file
+        self.wb.save(self.filename)
+
+
+class XlsxStreamingWriter(Writer):
+    """ Excel workbook in openpyxl write-only mode: rows are streamed to the file as they
+    are produced, and number formats are applied when each row is emitted instead of in
+    a second pass """
+
+    spreadsheet = True
+
+    def __init__(self, filename: str):
+        import openpyxl as xl
+
+        super().__init__(filename)
+        self.wb = xl.Workbook(write_only = True)
+        self.ws = self.wb.create_sheet("Sommaire de l'EPP")
+
+        # write header
+        self.ws.append(build_header())
+
+    def write_rows(self, team: m.Team, rows: list) -> None:
+        from openpyxl.worksheet.cell_range import CellRange
+
+        for row in rows:
+            self.ws.append(style_row(self.ws, row))
+        self.ws.merged_cells.add(CellRange(min_col = 8, min_row = self.row_counter, max_col = 8, max_row = self.row_counter + len(team) - 1))
+
+    def close(self) -> None:
+        self.wb.save(self.filename)
+
+
+class CsvWriter(Writer):
+    """ csv file, semicolon separated as the Workshop ÉTS exports.
+    Note_equipe and Note_etudiant are empty. """
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self.file = open(filename, "wt", newline = "")
+        self.csv_writer = csv.writer(self.file, delimiter = ";")
+        self.csv_writer.writerow(build_header())
+
+    def write_rows(self, team: m.Team, rows: list) -> None:
+        self.csv_writer.writerows(rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def abort(self) -> None:
+        self.file.close()
+        self.remove()
+
+
+# key added by the json writers, null if the note was not overridden
+SOURCE_COLUMN = "Ligne_note_modif"
+
+
+class JsonLinesWriter(Writer):
+    """ JSON Lines file: one object per student, keyed by the column names of build_header()
+    and SOURCE_COLUMN. Note_equipe and Note_etudiant are null. """
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self.header = build_header()
+        self.file = open(filename, "wt", encoding = "utf-8")
+
+    def build_objects(self, team: m.Team, rows: list):
+        """ generator that yields the object of each student of team """
+        for evaluated, row in zip(team, rows):
+            o = dict(zip(self.header, row))
+            o[SOURCE_COLUMN] = evaluated.override_source
+            yield o
+
+    def write_rows(self, team: m.Team, rows: list) -> None:
+        for o in self.build_objects(team, rows):
+            self.file.write(json.dumps(o, ensure_ascii = False) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+    def abort(self) -> None:
+        self.file.close()
+        self.remove()
+
+
+class JsonWriter(JsonLinesWriter):
+    """ json file: a list of objects, as in JsonLinesWriter.
+    The list is written incrementally, one object at a time. """
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self.file.write("[")
+        self.separator = "\n "
+
+    def write_rows(self, team: m.Team, rows: list) -> None:
+        for o in self.build_objects(team, rows):
+            self.file.write(self.separator + json.dumps(o, ensure_ascii = False))
+            self.separator = ",\n "
+
+    def close(self) -> None:
+        self.file.write("\n]\n")
+        super().close()
+
+
+class ParquetWriter(Writer):
+    """ Parquet file (Apache Arrow), for bulk loading in a data warehouse.
+    Rows are buffered and written as a row group every batch_size students, so that
+    row groups are not too small while memory stays bounded.
+    Note: you may have to install the 'pyarrow' Python library:
+         $ pip install pyarrow """
+
+    def __init__(self, filename: str, batch_size: int = 65536):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(filename)
+        self.pa = pa
+        self.header = build_header()
+        string, double = pa.string(), pa.float64()
+        self.schema = pa.schema(list(zip(self.header, [string, string, string, string, double, double, double, double, double])))
+        self.writer = pq.ParquetWriter(filename, self.schema)
+        self.batch_size = batch_size
+        self.columns = [[] for _ in self.header]
+
+    def write_rows(self, team: m.Team, rows: list) -> None:
+        for row in rows:
+            for column, value in zip(self.columns, row):
+                column.append(value)
+        if len(self.columns[0]) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.columns[0]) > 0:
+            self.writer.write_table(self.pa.table(self.columns, schema = self.schema))
+            self.columns = [[] for _ in self.header]
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+    def abort(self) -> None:
+        self.writer.close()
+        self.remove()
+
+
+# output formats, by name (see EPP.py option -f)
+WRITERS = {
+    "xlsx": XlsxWriter,
+    "xlsx-stream": XlsxStreamingWriter,
+    "csv": CsvWriter,
+    "json": JsonWriter,
+    "jsonl": JsonLinesWriter,
+    "parquet": ParquetWriter,
+}
+
+
+def write_teams(filename: str, teams, format: str = "xlsx") -> None:
+    """ write an iterable of computed teams in the format designated by its name in WRITERS.
+        overwrite any existing file of the same name. """
+
+    with st.stage("write") as counts:
+        counts["teams"] = 0
+        with WRITERS[format](filename) as writer:
+            for team in teams:
+                writer.write_team(team)
+                counts["teams"] += 1
+        counts["students"] = writer.row_counter - 2
+
+
+def write_table(filename: str, header: list, rows: list, format: str = "xlsx", title: str = "Sommaire") -> None:
+    """ write a table (a header and a list of rows, ex. epp_rounds.build_table()) in one of
+    the formats of WRITERS, except the team layout: no merged cells nor formula.
+    In xlsx, float values are formatted with two decimals. """
+
+    with st.stage("write") as counts:
+        if format in ("xlsx", "xlsx-stream"):
+            import openpyxl as xl
+            wb = xl.Workbook()
+            ws = wb.active
+            ws.title = title
+            ws.append(header)
+            for row in rows:
+                ws.append(row)
+                for c in ws[ws.max_row]:
+                    if type(c.value) is float:
+                        c.number_format = '0.00'
+            wb.save(filename)
+        elif format == "csv":
+            with open(filename, "wt", newline = "") as f:
+                csv_writer = csv.writer(f, delimiter = ";")
+                csv_writer.writerow(header)
+                csv_writer.writerows(rows)
+        elif format in ("json", "jsonl"):
+            objects = [dict(zip(header, row)) for row in rows]
+            with open(filename, "wt", encoding = "utf-8") as f:
+                if format == "json":
+                    json.dump(objects, f, ensure_ascii = False, indent = 1)
+                    f.write("\n")
+                else:
+                    for o in objects:
+                        f.write(json.dumps(o, ensure_ascii = False) + "\n")
+        elif format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table([list(column) for column in zip(*rows)] if rows else [[] for _ in header], names = header), filename)
+        else:
+            raise KeyError(format)
+        counts["rows"] = len(rows)
 
-""" Static function to write and Excel containing the resutls of a peer evaluation (epp) """
 
 def write_xlsx(filename: str, epp: m.EPP) -> None:
     """ write the content of the epp structure to an Excel file designated by filename.
         overwrite any existing file of the same name. """
-    
-    wb = xl.Workbook()
-    ws = wb.active
-    ws.title = "Sommaire de l'EPP"
-    
-    # write header
-    ws.append(build_header())
-    
-    # write data
-    row_counter = 2
-    for team in epp:
-        first_row = row_counter
-        rows = build_rows(team, row_counter)
-        row_counter += len(team)
-        for row in rows:
-            ws.append(row)
-        ws.merge_cells(start_row = first_row, start_column = 8, end_row = row_counter-1, end_column = 8)
-        
-    # set style
-    for i in range(2, row_counter+1):
-        c = ws.cell(i, 5)
-        c.number_format = '0.00'
-        c = ws.cell(i, 6)
-        c.number_format = '0.00'
-        c = ws.cell(i, 7)
-        c.number_format = '0.00'
-        c = ws.cell(i, 9)
+    write_teams(filename, epp, "xlsx")
+
+
+def write_xlsx_fast(filename: str, epp: m.EPP) -> None:
+    """ same as write_xlsx(), but uses openpyxl write-only mode (see XlsxStreamingWriter).
+        Memory usage does not grow with the number of rows. """
+    write_teams(filename, epp, "xlsx-stream")
+
+
+def write_csv(filename: str, epp: m.EPP) -> None:
+    """ write the same columns as write_xlsx() to a csv file (see CsvWriter) """
+    write_teams(filename, epp, "csv")
+
+
+def write_json(filename: str, epp: m.EPP) -> None:
+    """ write the same columns as write_xlsx() to a json file (see JsonWriter) """
+    write_teams(filename, epp, "json")
+
+
+def style_row(ws, row: list) -> list:
+    """ wrap the numeric columns (Note_EPP, MNG, Facteur and Note_etudiant) of a row
+        in write-only cells formatted with two decimals """
+    from openpyxl.cell import WriteOnlyCell
+
+    for col in (4, 5, 6, 8):
+        c = WriteOnlyCell(ws, row[col])
         c.number_format = '0.00'
-            
-    # save to file
-    wb.save(filename)
-    
-    
-def build_rows(team: m.Team, row_counter: int) -> list:
-    """ build rows containing en entire team """
+        row[col] = c
+    return row
+
+
+def build_rows(team: m.Team, row_counter: int, spreadsheet: bool = True) -> list:
+    """ build rows containing en entire team.
+    Without spreadsheet, Note_equipe and Note_etudiant are None instead of an empty cell
+    and a formula. """
     rows = []
     for index, e in enumerate(team):
-        formula = get_formula(row_counter + index, row_counter)
-        row = [team.name, e.last_name, e.surname, e.email, e.note, team.average, e.factor, "", formula]
+        if spreadsheet:
+            team_note, formula = "", get_formula(row_counter + index, row_counter)
+        else:
+            team_note, formula = None, None
+        row = [team.name, e.last_name, e.surname, e.email, e.note, team.average, e.factor, team_note, formula]
         rows.append(row)
 
     return rows